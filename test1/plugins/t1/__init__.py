@@ -3,22 +3,13 @@ from nonebot.plugin import PluginMetadata
 from nonebot.adapters.onebot.v11 import MessageSegment, MessageEvent
 
 from .config import Config
+from .constants import USAGE
 
 # 定义插件元信息，用于 help 等场景
 __plugin_meta__ = PluginMetadata(
     name="Kon! bot",
     description="一个 osu! 推图bot。",
-    usage="""
-提供以下 osu! 功能：
-- /bid [谱面ID]: 查询谱面详细信息和 Oracle 分类。
-- /konbind [用户名]: 绑定你的 osu! 账号。
-- /konunbind: 解除 osu! 账号绑定。
-- /推荐 [类型] [谱面ID] [备注]: 向谱面库推荐一张图。
-- /随机推图 [条件]: 根据条件随机从库中推荐谱面。
-- /pending [操作]: (管理员) 管理待审核谱面。
-- /konhelp: 显示详细帮助信息。
-- /笔哥: 机器人应答。
-""",
+    usage=USAGE,
     config=Config,
 )
 
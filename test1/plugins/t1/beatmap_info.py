@@ -1,11 +1,12 @@
+import asyncio
 from typing import Optional
 
 from nonebot import on_command, logger
 from nonebot.params import CommandArg
 from nonebot.adapters.onebot.v11 import Message, MessageEvent, MessageSegment
 
-from .utils import get_official_beatmap_info, get_oracle_classification
-from .__init__ import __plugin_meta__
+from .utils import get_official_beatmap_info, get_oracle_classification, parse_id
+from .constants import USAGE
 
 # 创建 /bid 命令的事件响应器
 bid_matcher = on_command("bid", aliases={"谱面信息", "查询谱面"}, priority=10, block=True)
@@ -15,13 +16,11 @@ async def handle_bid_command(event: MessageEvent, args: Message = CommandArg()):
     """处理 /bid 命令，查询并显示谱面信息"""
     arg_text = args.extract_plain_text().strip()
     if not arg_text:
-        await bid_matcher.finish("请输入谱面ID (bid)！\n使用方法：" + __plugin_meta__.usage)
+        await bid_matcher.finish("请输入谱面ID (bid)！\n使用方法：" + USAGE)
 
-    try:
-        beatmap_id = int(arg_text)
-    except ValueError:
+    beatmap_id = parse_id(arg_text)
+    if beatmap_id is None:
         await bid_matcher.finish("谱面ID必须是数字！")
-        return
 
 #    await bid_matcher.send(f"正在查询 bid: {beatmap_id} 的信息，请稍候...")
 
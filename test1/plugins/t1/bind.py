@@ -1,4 +1,4 @@
-import pymysql
+import asyncio
 from typing import Optional, Dict, Any
 from datetime import datetime
 
@@ -6,7 +6,12 @@ from nonebot import on_command, logger
 from nonebot.params import CommandArg
 from nonebot.adapters.onebot.v11 import Message, MessageEvent
 
-from .utils import get_osu_token, get_db_connection, get_proxied_http_client
+from .utils import get_osu_token, get_pool, get_proxied_http_client, MySQLError, invalidate_user_binding_cache
+
+# 插入或更新 QQUsers 表
+UPSERT_QQ_USER_SQL = "INSERT INTO QQUsers (qqid, nickname, created_at) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE nickname = VALUES(nickname)"
+# 插入绑定记录
+INSERT_USER_BINDING_SQL = "INSERT INTO UserBindings (qqid, osu_uid, osu_username_at_bind, bind_time) VALUES (%s, %s, %s, %s)"
 
 # --- osu! API 函数 ---
 async def get_osu_user_info_by_username(username: str) -> Optional[Dict[str, Any]]:
@@ -21,18 +26,18 @@ async def get_osu_user_info_by_username(username: str) -> Optional[Dict[str, Any
     
     logger.info(f"正在通过 osu! API 查询用户: {username}")
     try:
-        async with get_proxied_http_client() as client:
-            response = await client.get(api_url, headers=headers)
-            if response.status_code == 404:
-                logger.warning(f"osu! API 未找到用户: {username}")
-                return None
-            response.raise_for_status()
-            user_data = response.json()
-            if "id" in user_data and "username" in user_data:
-                return {"osu_uid": user_data["id"], "osu_username": user_data["username"]}
-            else:
-                logger.error(f"从 osu! API 获取的用户数据不完整: {user_data}")
-                return None
+        client = get_proxied_http_client()
+        response = await client.get(api_url, headers=headers)
+        if response.status_code == 404:
+            logger.warning(f"osu! API 未找到用户: {username}")
+            return None
+        response.raise_for_status()
+        user_data = response.json()
+        if "id" in user_data and "username" in user_data:
+            return {"osu_uid": user_data["id"], "osu_username": user_data["username"]}
+        else:
+            logger.error(f"从 osu! API 获取的用户数据不完整: {user_data}")
+            return None
     except Exception as e:
         logger.error(f"查询 osu! 用户信息时发生错误: {e}")
         return None
@@ -40,78 +45,70 @@ async def get_osu_user_info_by_username(username: str) -> Optional[Dict[str, Any
 # --- 数据库操作函数 ---
 async def db_check_qq_binding(qqid: int) -> Optional[Dict[str, Any]]:
     """检查QQ号是否已绑定，若绑定则返回信息"""
-    conn = get_db_connection()
-    if not conn: return None
+    pool = await get_pool()
+    if not pool: return None
     try:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT osu_uid, osu_username_at_bind FROM UserBindings WHERE qqid = %s", (qqid,))
-            return cursor.fetchone()
-    except pymysql.MySQLError as e:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("SELECT osu_uid, osu_username_at_bind FROM UserBindings WHERE qqid = %s", (qqid,))
+                return await cursor.fetchone()
+    except MySQLError as e:
         logger.error(f"查询QQ绑定信息失败: {e}")
         return None
-    finally:
-        if conn: conn.close()
 
 async def db_check_osu_uid_binding(osu_uid: int) -> Optional[Dict[str, Any]]:
     """检查osu_uid是否已被他人绑定"""
-    conn = get_db_connection()
-    if not conn: return None
+    pool = await get_pool()
+    if not pool: return None
     try:
-        with conn.cursor() as cursor:
-            sql = """
-            SELECT ub.qqid, qq.nickname FROM UserBindings ub
-            LEFT JOIN QQUsers qq ON ub.qqid = qq.qqid
-            WHERE ub.osu_uid = %s
-            """
-            cursor.execute(sql, (osu_uid,))
-            return cursor.fetchone()
-    except pymysql.MySQLError as e:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                sql = """
+                SELECT ub.qqid, qq.nickname FROM UserBindings ub
+                LEFT JOIN QQUsers qq ON ub.qqid = qq.qqid
+                WHERE ub.osu_uid = %s
+                """
+                await cursor.execute(sql, (osu_uid,))
+                return await cursor.fetchone()
+    except MySQLError as e:
         logger.error(f"查询osu_uid绑定信息失败: {e}")
         return None
-    finally:
-        if conn: conn.close()
 
 async def db_bind_user(qqid: int, osu_uid: int, osu_username: str, qq_nickname: str) -> bool:
     """执行绑定操作，写入数据库"""
-    conn = get_db_connection()
-    if not conn: return False
+    pool = await get_pool()
+    if not pool: return False
     try:
-        with conn.cursor() as cursor:
-            current_time = datetime.now()
-            # 插入或更新 QQUsers 表
-            cursor.execute(
-                "INSERT INTO QQUsers (qqid, nickname, created_at) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE nickname = VALUES(nickname)",
-                (qqid, qq_nickname, current_time)
-            )
-            # 插入绑定记录
-            cursor.execute(
-                "INSERT INTO UserBindings (qqid, osu_uid, osu_username_at_bind, bind_time) VALUES (%s, %s, %s, %s)",
-                (qqid, osu_uid, osu_username, current_time)
-            )
-            conn.commit()
-            return True
-    except pymysql.MySQLError as e:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                current_time = datetime.now()
+                await conn.begin()
+                try:
+                    await cursor.execute(UPSERT_QQ_USER_SQL, (qqid, qq_nickname, current_time))
+                    await cursor.execute(INSERT_USER_BINDING_SQL, (qqid, osu_uid, osu_username, current_time))
+                    await conn.commit()
+                except MySQLError:
+                    await conn.rollback()
+                    raise
+                invalidate_user_binding_cache(qqid)
+                return True
+    except MySQLError as e:
         logger.error(f"执行绑定操作失败: {e}")
-        if conn: conn.rollback()
         return False
-    finally:
-        if conn: conn.close()
 
 async def db_unbind_user(qqid: int) -> bool:
     """执行解绑操作，从数据库删除记录"""
-    conn = get_db_connection()
-    if not conn: return False
+    pool = await get_pool()
+    if not pool: return False
     try:
-        with conn.cursor() as cursor:
-            rows_affected = cursor.execute("DELETE FROM UserBindings WHERE qqid = %s", (qqid,))
-            conn.commit()
-            return rows_affected > 0
-    except pymysql.MySQLError as e:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                rows_affected = await cursor.execute("DELETE FROM UserBindings WHERE qqid = %s", (qqid,))
+                invalidate_user_binding_cache(qqid)
+                return rows_affected > 0
+    except MySQLError as e:
         logger.error(f"执行解绑操作失败 (QQID: {qqid}): {e}")
-        if conn: conn.rollback()
         return False
-    finally:
-        if conn: conn.close()
 
 # --- 命令处理器 ---
 bind_matcher = on_command("konbind", aliases={"绑定osu", "osu绑定"}, priority=10, block=True)
@@ -125,17 +122,19 @@ async def handle_bind_command(event: MessageEvent, args: Message = CommandArg())
     if not osu_username_to_bind:
         await bind_matcher.finish("请输入你要绑定的 osu! 用户名。\n使用方法: /konbind [osu!用户名]")
 
-    # 1. 检查QQ是否已绑定
-    if existing_binding := await db_check_qq_binding(qqid):
+    # 1. 并行检查QQ绑定状态并查询 osu! API 获取用户信息
+    existing_binding, osu_user_info = await asyncio.gather(
+        db_check_qq_binding(qqid),
+        get_osu_user_info_by_username(osu_username_to_bind)
+    )
+
+    if existing_binding:
         await bind_matcher.finish(
             f"你已经绑定了 osu! 账号: {existing_binding['osu_username_at_bind']} (UID: {existing_binding['osu_uid']})。\n"
             "如需换绑，请先使用 /konunbind 解绑。"
         )
 
-    await bind_matcher.send(f"正在查询 osu! 用户 [{osu_username_to_bind}] 的信息并尝试绑定...")
-
-    # 2. 查询 osu! API 获取用户信息
-    osu_user_info = await get_osu_user_info_by_username(osu_username_to_bind)
+    # 2. 检查 osu! API 查询结果
     if not osu_user_info:
         await bind_matcher.finish(f"未能找到 osu! 用户 [{osu_username_to_bind}] 或查询API时出错，请检查用户名是否正确。")
     
@@ -18,6 +18,11 @@ class Config(BaseModel, extra=Extra.ignore):
     db_user: str = "root"
     db_password: str 
     db_name: str = "kon_bot_db"
+    db_pool_minsize: int = 5
+    db_pool_maxsize: int = 25
+
+    # --- Redis 缓存配置 (留空则不启用缓存) ---
+    redis_url: Optional[str] = None
 
     # --- 网络代理配置 ---
     http_proxy: Optional[str] = None
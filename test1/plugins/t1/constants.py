@@ -0,0 +1,12 @@
+# 插件用法说明，供 __plugin_meta__ 与各命令的提示信息共用
+USAGE = """
+提供以下 osu! 功能：
+- /bid [谱面ID]: 查询谱面详细信息和 Oracle 分类。
+- /konbind [用户名]: 绑定你的 osu! 账号。
+- /konunbind: 解除 osu! 账号绑定。
+- /推荐 [类型] [谱面ID] [备注]: 向谱面库推荐一张图。
+- /随机推图 [条件]: 根据条件随机从库中推荐谱面。
+- /pending [操作]: (管理员) 管理待审核谱面。
+- /konhelp: 显示详细帮助信息。
+- /笔哥: 机器人应答。
+"""
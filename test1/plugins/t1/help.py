@@ -50,7 +50,9 @@
 ##      """处理帮助命令，发送预设的帮助信息。"""
 ##      await help_matcher.send(Message(HELP_MESSAGE))
 
+import base64
 from pathlib import Path
+from typing import Optional
 from nonebot import on_command
 from nonebot.adapters.onebot.v11 import MessageSegment
 
@@ -66,10 +68,25 @@ help_matcher = on_command(
 HELP_IMAGE_PATH = Path(__file__).parent / "draw" / "helpdraw.jpg"
 
 
+def load_help_image() -> Optional[MessageSegment]:
+    """读取帮助图片并编码为 base64 图片消息段，图片不存在时返回 None。"""
+    if not HELP_IMAGE_PATH.exists():
+        return None
+    encoded = base64.b64encode(HELP_IMAGE_PATH.read_bytes()).decode()
+    return MessageSegment.image(f"base64://{encoded}")
+
+
+# 导入时编码一次，之后每次直接复用，避免重复读盘和编码
+HELP_IMAGE_MESSAGE = load_help_image()
+
+
 @help_matcher.handle()
 async def handle_help_command():
     """
     处理帮助命令，发送预设的帮助图片。
     """
-    image_message = MessageSegment.image(HELP_IMAGE_PATH.as_uri())
+    global HELP_IMAGE_MESSAGE
+    if HELP_IMAGE_MESSAGE is None:  # 导入时图片尚不存在，再尝试加载一次
+        HELP_IMAGE_MESSAGE = load_help_image()
+    image_message = HELP_IMAGE_MESSAGE or MessageSegment.image(HELP_IMAGE_PATH.as_uri())
     await help_matcher.send(image_message)
@@ -1,15 +1,18 @@
-import pymysql
 import re
 import random
 import asyncio
+import functools
+from types import MappingProxyType
 from typing import Optional, Dict, Any, Tuple, List, Union
 from datetime import datetime
 
-from nonebot import on_command, logger
+from nonebot import on_command, logger, get_driver
 from nonebot.params import CommandArg
 from nonebot.adapters.onebot.v11 import Message, MessageEvent, MessageSegment, Bot
 
-from .utils import get_db_connection, get_official_beatmap_info
+from redis.exceptions import RedisError
+
+from .utils import get_pool, get_redis, get_official_beatmap_info, fetch_all_as_dicts, Cursor, MySQLError
 
 # 类型别名和有效类型定义
 TYPE_ALIASES: Dict[str, str] = {
@@ -28,40 +31,163 @@ FIELD_MAP: Dict[str, Tuple[str, str, bool]] = {
     "length": ("bi", "length_seconds", True), "bpm": ("bi", "bpm", True),
 }
 
+# 筛选条件解析用的正则，预编译避免每次调用时查找缓存
+_FILTER_FIELD_RE = re.compile(r"^([a-z_]+)((?:>=|<=|>|<|=)?[\d\.-]+[sm]?)$")
+_VALUE_OP_RE = re.compile(r"^(>=|<=|>|<|=)?([\d\.]+)(?:-([\d\.]+))?$")
+
+# Oracle 概率的显示名称与对应字段
+_PROB_DISPLAY_FIELDS = (
+    ("Stream", "stream_prob"), ("Jump", "jump_prob"), ("Alt", "alt_prob"), ("Tech", "tech_prob"),
+)
+
+# 随机推图查询返回的字段，只取 format_beatmap_result_for_display 用到的列
+# 建议在数据库中建立以下索引以支持类型筛选与数值范围筛选:
+#   CREATE INDEX idx_ba_type_bid ON BeatmapAnalysis (determined_b_type, bid);
+#   CREATE INDEX idx_bi_star ON BeatmapInfo (star_rating, bpm, ar, od, length_seconds);
+RANDOM_RECOMMEND_FIELDS = (
+    "bi.bid, bi.title, bi.artist, bi.diff_name, bi.creator_username, bi.beatmap_status, "
+    "bi.bpm, bi.star_rating, bi.length_seconds, bi.cs, bi.ar, bi.od, bi.hp, "
+    "ba.determined_b_type, ba.stream_prob, ba.jump_prob, ba.alt_prob, ba.tech_prob"
+)
+
+# 无筛选条件时使用的“热门集合”：每种类型预先抽样一批 bid 存入 Redis 集合，定时刷新
+HOT_SET_KEY_PREFIX = "rr:hot:"
+HOT_SET_ALL_TYPES = "all"
+HOT_SET_SIZE = 2000
+HOT_SET_REFRESH_INTERVAL_SECONDS = 600
+
+# 合并转发消息中显示的发送者名称
+FORWARD_NODE_NAME = "Kon! Bot"
+
+driver = get_driver()
+_hot_set_task: Optional[asyncio.Task] = None
+
 # --- 辅助函数 (模块内专用) ---
 
+async def refresh_hot_sets() -> None:
+    """从数据库读取各类型谱面ID，抽样后写入 Redis 集合。"""
+    redis = get_redis()
+    pool = await get_pool()
+    if not redis or not pool: return
+    try:
+        async with pool.acquire() as conn:
+            async with conn.cursor(Cursor) as cursor:
+                await cursor.execute(
+                    "SELECT ba.bid, ba.determined_b_type FROM BeatmapAnalysis ba JOIN BeatmapInfo bi ON bi.bid = ba.bid"
+                )
+                rows = await cursor.fetchall()
+    except MySQLError as e:
+        logger.error(f"刷新随机推图热门集合失败: {e}")
+        return
+
+    bids_by_type: Dict[str, List[int]] = {t: [] for t in (*VALID_DB_TYPES, HOT_SET_ALL_TYPES)}
+    for bid, b_type in rows:
+        bids_by_type[HOT_SET_ALL_TYPES].append(bid)
+        if b_type in bids_by_type:
+            bids_by_type[b_type].append(bid)
+
+    try:
+        async with redis.pipeline(transaction=True) as pipe:
+            for b_type, bids in bids_by_type.items():
+                key = f"{HOT_SET_KEY_PREFIX}{b_type}"
+                pipe.delete(key)
+                if bids:
+                    pipe.sadd(key, *random.sample(bids, min(len(bids), HOT_SET_SIZE)))
+            await pipe.execute()
+        logger.info(f"随机推图热门集合已刷新，共 {len(rows)} 张谱面")
+    except RedisError as e:
+        logger.error(f"写入随机推图热门集合失败: {e}")
+
+async def _hot_set_refresher() -> None:
+    """后台循环定时刷新热门集合"""
+    while True:
+        await refresh_hot_sets()
+        await asyncio.sleep(HOT_SET_REFRESH_INTERVAL_SECONDS)
+
+@driver.on_startup
+async def _start_hot_set_refresher():
+    """配置了 Redis 时启动热门集合的刷新任务"""
+    global _hot_set_task
+    if get_redis():
+        _hot_set_task = asyncio.create_task(_hot_set_refresher())
+
+@driver.on_shutdown
+async def _stop_hot_set_refresher():
+    """关闭时取消刷新任务"""
+    if _hot_set_task:
+        _hot_set_task.cancel()
+
+async def get_hot_set_recommendations(b_type: Optional[str], count: int) -> List[Dict[str, Any]]:
+    """
+    从热门集合中随机抽取谱面，并按 bid 主键一次性读取谱面数据。
+    Redis 未配置、集合为空或出错时返回空列表，由调用方回退到常规查询。
+    """
+    redis = get_redis()
+    if not redis: return []
+    try:
+        raw_bids = await redis.srandmember(f"{HOT_SET_KEY_PREFIX}{b_type or HOT_SET_ALL_TYPES}", count)
+    except RedisError as e:
+        logger.warning(f"读取随机推图热门集合失败: {e}")
+        return []
+    if not raw_bids: return []
+
+    bids = [int(b) for b in raw_bids]
+    sql = (
+        f"SELECT {RANDOM_RECOMMEND_FIELDS} FROM BeatmapInfo bi JOIN BeatmapAnalysis ba ON bi.bid = ba.bid "
+        f"WHERE bi.bid IN ({', '.join(['%s'] * len(bids))})"
+    )
+    params: List[Any] = list(bids)
+    if b_type:  # 集合刷新后分类可能已被管理员修改
+        sql += " AND ba.determined_b_type = %s"
+        params.append(b_type)
+
+    pool = await get_pool()
+    if not pool: return []
+    try:
+        async with pool.acquire() as conn:
+            async with conn.cursor(Cursor) as cursor:
+                await cursor.execute(sql, tuple(params))
+                return await fetch_all_as_dicts(cursor)
+    except MySQLError as e:
+        logger.error(f"按热门集合查询谱面失败: {e}")
+        return []
+
 async def get_beatmap_recommendations_sample(bid: int, sample_size: int = 3) -> List[Dict[str, Any]]:
     """从 Recommendations 表随机获取指定数量的推荐记录。"""
-    conn = get_db_connection()
-    if not conn: return []
+    pool = await get_pool()
+    if not pool: return []
     try:
-        with conn.cursor() as cursor:
-            sql = """
-            SELECT osu_username_at_recommend_time, recommended_at, recommendation_description
-            FROM Recommendations WHERE bid = %s ORDER BY RAND() LIMIT %s
-            """
-            cursor.execute(sql, (bid, sample_size))
-            return cursor.fetchall()
-    except pymysql.MySQLError as e:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                # 单个 bid 的推荐记录很少，ORDER BY RAND() 只对这一小部分排序，一次查询即可
+                sql = """
+                SELECT osu_username_at_recommend_time, recommended_at, recommendation_description
+                FROM Recommendations WHERE bid = %s ORDER BY RAND() LIMIT %s
+                """
+                await cursor.execute(sql, (bid, sample_size))
+                return await cursor.fetchall()
+    except MySQLError as e:
         logger.error(f"查询谱面 {bid} 的推荐描述失败: {e}")
         return []
-    finally:
-        if conn: conn.close()
 
 def parse_value_and_operator(value_str: str) -> Tuple[str, Optional[float], Optional[float]]:
     """解析筛选条件的值部分，返回 (operator, value1, value2)"""
-    value_str = value_str.strip()
-    if match := re.match(r"^(>=|<=|>|<|=)([\d\.]+)$", value_str):
-        return match.group(1), float(match.group(2)), None
-    if match := re.match(r"^([\d\.]+)-([\d\.]+)$", value_str):
-        v1, v2 = float(match.group(1)), float(match.group(2))
-        return "=", min(v1, v2), max(v1, v2)
-    if match := re.match(r"^([\d\.]+)$", value_str):
-        return "=", float(match.group(1)), None
-    return "=", None, None
+    if not (match := _VALUE_OP_RE.match(value_str.strip())):
+        return "=", None, None
+    op, raw_v1, raw_v2 = match.groups()
+    try:
+        if raw_v2 is None:
+            return op or "=", float(raw_v1), None
+        if op:  # 范围写法不支持附带比较符，如 ">=5-6"
+            return "=", None, None
+        v1, v2 = float(raw_v1), float(raw_v2)
+    except ValueError:  # 形如 "1..2" 的非法数字
+        return "=", None, None
+    return "=", min(v1, v2), max(v1, v2)
 
-def parse_random_query_args(arg_text: str) -> Dict[str, Any]:
-    """解析随机推图命令的参数。"""
+@functools.lru_cache(maxsize=512)
+def _parse_random_query_args_cached(arg_text: str) -> MappingProxyType:
+    """解析随机推图命令的参数，按命令文本缓存，返回只读结果。"""
     params: Dict[str, Any] = {"type": None, "count": 1, "filters": []}
     parts = arg_text.lower().split()
     
@@ -82,7 +208,7 @@ def parse_random_query_args(arg_text: str) -> Dict[str, Any]:
         parts.pop(0)
 
     for part in parts:
-        if not (match := re.match(r"^([a-z_]+)((?:>=|<=|>|<|=)?[\d\.-]+[sm]?)$", part)):
+        if not (match := _FILTER_FIELD_RE.match(part)):
             continue
         field, value_op_str = match.groups()
 
@@ -101,12 +227,17 @@ def parse_random_query_args(arg_text: str) -> Dict[str, Any]:
             filter_entry["value2"] = v2 * multiplier
         params["filters"].append(filter_entry)
         
-    return params
+    params["filters"] = tuple(MappingProxyType(f) for f in params["filters"])
+    return MappingProxyType(params)
+
+def parse_random_query_args(arg_text: str) -> Dict[str, Any]:
+    """解析随机推图命令的参数，返回可自由修改的副本。"""
+    cached = _parse_random_query_args_cached(arg_text)
+    return {"type": cached["type"], "count": cached["count"], "filters": [dict(f) for f in cached["filters"]]}
 
 def build_sql_query(parsed_args: Dict[str, Any]) -> Tuple[str, List[Union[str, float, int]]]:
-    """根据解析的参数构建SQL查询。"""
-    fields = "bi.*, ba.determined_b_type, ba.stream_prob, ba.jump_prob, ba.alt_prob, ba.tech_prob"
-    sql = f"SELECT {fields} FROM BeatmapInfo bi JOIN BeatmapAnalysis ba ON bi.bid = ba.bid"
+    """根据解析的参数构建 SQL 查询的 FROM/WHERE 部分。"""
+    sql = "FROM BeatmapInfo bi JOIN BeatmapAnalysis ba ON bi.bid = ba.bid"
     clauses, params = [], []
 
     if parsed_args["type"]:
@@ -127,63 +258,109 @@ def build_sql_query(parsed_args: Dict[str, Any]) -> Tuple[str, List[Union[str, f
     if clauses:
         sql += " WHERE " + " AND ".join(clauses)
     
-    sql += " ORDER BY RAND() LIMIT %s"
-    params.append(parsed_args["count"])
     return sql, params
 
-async def execute_random_recommend_query(sql: str, params: List[Any]) -> List[Dict[str, Any]]:
-    """执行查询并返回结果。"""
-    conn = get_db_connection()
-    if not conn: return []
+async def execute_random_recommend_query(from_sql: str, params: List[Any], count: int) -> List[Dict[str, Any]]:
+    """
+    执行查询并随机返回至多 count 条结果。
+    先统计符合条件的记录数，再在 Python 中随机抽取偏移量逐条读取，
+    避免 ORDER BY RAND() 对所有匹配行建临时表排序。
+    """
+    pool = await get_pool()
+    if not pool: return []
     try:
-        with conn.cursor() as cursor:
-            cursor.execute(sql, tuple(params))
-            return cursor.fetchall()
-    except pymysql.MySQLError as e:
+        async with pool.acquire() as conn:
+            async with conn.cursor(Cursor) as cursor:
+                await cursor.execute(f"SELECT COUNT(*) {from_sql}", tuple(params))
+                total = (await cursor.fetchone())[0]
+                if not total: return []
+
+                sql = f"SELECT {RANDOM_RECOMMEND_FIELDS} {from_sql} ORDER BY bi.bid LIMIT 1 OFFSET %s"
+                rows = []
+                for offset in random.sample(range(total), min(count, total)):
+                    await cursor.execute(sql, (*params, offset))
+                    if row := await cursor.fetchone():
+                        rows.append(row)
+                if not rows: return []
+                # 每次查询的列相同，只需解析一次列名
+                columns = [column[0] for column in cursor.description]
+                return [dict(zip(columns, row)) for row in rows]
+    except MySQLError as e:
         logger.error(f"执行随机推图查询失败: {e}")
         return []
-    finally:
-        if conn: conn.close()
 
 def format_beatmap_result_for_display(
     beatmap_data: Dict[str, Any], recommendations: Optional[List[Dict[str, Any]]] = None
 ) -> str:
     """格式化单个谱面数据用于QQ消息显示。"""
-    length = beatmap_data.get('length_seconds')
+    bid, bpm, stars, cs, ar, od, hp, length = (
+        beatmap_data.get(k) for k in ("bid", "bpm", "star_rating", "cs", "ar", "od", "hp", "length_seconds")
+    )
     length_str = f"{length // 60}m{length % 60}s" if length is not None else "N/A"
-    probs = {
-        "Stream": beatmap_data.get('stream_prob'), "Jump": beatmap_data.get('jump_prob'),
-        "Alt": beatmap_data.get('alt_prob'), "Tech": beatmap_data.get('tech_prob'),
-    }
-    probs_list = [f"{k}: {v:.2%}" for k, v in probs.items() if v is not None]
-    
-    parts = [
-        f"谱面ID: {beatmap_data.get('bid')} ({beatmap_data.get('beatmap_status', 'N/A').capitalize()})",
-        f"标题: {beatmap_data.get('artist', 'N/A')} - {beatmap_data.get('title', 'N/A')} [{beatmap_data.get('diff_name', 'N/A')}]",
-        f"Mapper: {beatmap_data.get('creator_username', 'N/A')}",
-        f"BPM: {beatmap_data.get('bpm')} | ★: {float(beatmap_data.get('star_rating', 0.0)):.2f} | 时长: {length_str}",
-        f"CS: {beatmap_data.get('cs')} | AR: {beatmap_data.get('ar')} | OD: {beatmap_data.get('od')} | HP: {beatmap_data.get('hp')}",
-        f"链接: https://osu.ppy.sh/b/{beatmap_data.get('bid')}",
-        f"谱面库分类: 【{beatmap_data.get('determined_b_type', '未知').upper()}】",
-        f"Oracle概率: {', '.join(probs_list) if probs_list else '无详细概率数据'}",
-        ""
-    ]
-    if recommendations:
-        for rec in recommendations:
-            time_str = rec.get('recommended_at').strftime('%Y年%m月%d日') if isinstance(rec.get('recommended_at'), datetime) else "某时"
-            rec_user = rec.get('osu_username_at_recommend_time', '一位热心玩家')
-            rec_desc = rec.get('recommendation_description')
-
-            base_text = f"{rec_user} 在{time_str}推荐了这张图"
-            
-            if rec_desc == "TA没有填写描述！":
-                parts.append(f"{base_text}！")
-            else:
-                parts.append(f"{base_text}：{rec_desc}")
-    else:
-        parts.append("还没有人推过这张图呢！")
+    probs_text = ", ".join(
+        f"{name}: {prob:.2%}" for name, key in _PROB_DISPLAY_FIELDS
+        if (prob := beatmap_data.get(key)) is not None
+    ) or "无详细概率数据"
+
+    header = (
+        f"谱面ID: {bid} ({beatmap_data.get('beatmap_status', 'N/A').capitalize()})\n"
+        f"标题: {beatmap_data.get('artist', 'N/A')} - {beatmap_data.get('title', 'N/A')} [{beatmap_data.get('diff_name', 'N/A')}]\n"
+        f"Mapper: {beatmap_data.get('creator_username', 'N/A')}\n"
+        f"BPM: {bpm} | ★: {float(stars if stars is not None else 0.0):.2f} | 时长: {length_str}\n"
+        f"CS: {cs} | AR: {ar} | OD: {od} | HP: {hp}\n"
+        f"链接: https://osu.ppy.sh/b/{bid}\n"
+        f"谱面库分类: 【{beatmap_data.get('determined_b_type', '未知').upper()}】\n"
+        f"Oracle概率: {probs_text}\n"
+        "\n"
+    )
+    if not recommendations:
+        return header + "还没有人推过这张图呢！"
+
+    rec_lines = []
+    for rec in recommendations:
+        time_str = rec.get('recommended_at').strftime('%Y年%m月%d日') if isinstance(rec.get('recommended_at'), datetime) else "某时"
+        rec_user = rec.get('osu_username_at_recommend_time', '一位热心玩家')
+        rec_desc = rec.get('recommendation_description')
+
+        if rec_desc == "TA没有填写描述！":
+            rec_lines.append(f"{rec_user} 在{time_str}推荐了这张图！")
+        else:
+            rec_lines.append(f"{rec_user} 在{time_str}推荐了这张图：{rec_desc}")
         
-    return "\n".join(parts)
+    return header + "\n".join(rec_lines)
+
+async def fetch_display_extras(
+    results: List[Dict[str, Any]]
+) -> List[Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]]:
+    """并发查询每张谱面的官方信息与推荐记录，单张失败时以 (None, []) 代替。"""
+    per_bid = await asyncio.gather(
+        *[
+            asyncio.gather(get_official_beatmap_info(b['bid']), get_beatmap_recommendations_sample(b['bid']))
+            for b in results
+        ],
+        return_exceptions=True
+    )
+    extras = []
+    for beatmap_data, per_bid_result in zip(results, per_bid):
+        if isinstance(per_bid_result, BaseException):
+            logger.warning(f"获取谱面 {beatmap_data['bid']} 的官方信息或推荐记录失败: {per_bid_result}")
+            extras.append((None, []))
+        else:
+            extras.append(tuple(per_bid_result))
+    return extras
+
+def _build_content_msg(
+    beatmap_data: Dict[str, Any], official_info: Optional[Dict[str, Any]], recs: List[Dict[str, Any]]
+) -> Message:
+    """组装单张谱面的消息：封面图 (若有) + 文字信息。"""
+    content_msg = Message()
+    if official_info and (cover_url := official_info.get("beatmapset", {}).get("covers", {}).get("cover@2x")):
+        try:
+            content_msg.append(MessageSegment.image(cover_url))
+        except Exception as e:
+            logger.warning(f"添加谱面封面图失败 (bid: {beatmap_data.get('bid')}): {e}")
+    content_msg.append(format_beatmap_result_for_display(beatmap_data, recs))
+    return content_msg
 
 # --- 命令处理器 ---
 random_recommend_matcher = on_command("随机推图", aliases={"roll图", "抽图", "随机谱面", "随机推荐", "suiji", "随机"}, priority=10, block=True)
@@ -193,64 +370,35 @@ async def handle_random_recommend_command(bot: Bot, event: MessageEvent, args: M
     """处理 /随机推图 命令，根据结果数量选择发送方式。"""
     parsed_args = parse_random_query_args(args.extract_plain_text().strip())
     
-    sql, params = build_sql_query(parsed_args)
-    results = await execute_random_recommend_query(sql, params)
+    results = []
+    if not parsed_args["filters"]:  # 无数值筛选时优先走热门集合，避免扫描全表
+        results = await get_hot_set_recommendations(parsed_args["type"], parsed_args["count"])
+    if not results:
+        from_sql, params = build_sql_query(parsed_args)
+        results = await execute_random_recommend_query(from_sql, params, parsed_args["count"])
 
+    results = [b for b in results if b.get('bid')]
     if not results:
         await random_recommend_matcher.finish("没有找到符合你条件的谱面！尝试放宽一点筛选条件吧")
 
+    # 所有谱面的官方信息与推荐记录一次性并发查询
+    extras = await fetch_display_extras(results)
+
     # --- 根据结果数量决定发送方式 ---
     if len(results) == 1:
         # --- 情况1：只找到一张图，直接发送 ---
-        beatmap_data = results[0]
-        bid = beatmap_data.get('bid')
-
-        official_info, recs = await asyncio.gather(
-            get_official_beatmap_info(bid),
-            get_beatmap_recommendations_sample(bid)
-        )
-        text_part = format_beatmap_result_for_display(beatmap_data, recs)
-        
-        response_msg = Message()
-        if official_info and (cover_url := official_info.get("beatmapset", {}).get("covers", {}).get("cover@2x")):
-            try:
-                response_msg.append(MessageSegment.image(cover_url))
-            except Exception as e:
-                logger.warning(f"发送单张谱面封面图失败 (bid: {bid}): {e}")
-        
-        response_msg.append(text_part)
-        await random_recommend_matcher.send(response_msg)
+        official_info, recs = extras[0]
+        await random_recommend_matcher.send(_build_content_msg(results[0], official_info, recs))
 
     else:
         # --- 情况2：找到多张图，合并转发 ---
-        forward_nodes = []
-        bot_uin = bot.self_id
-        bot_name = "Kon! Bot"
-
-        for beatmap_from_db in results:
-            bid = beatmap_from_db.get('bid')
-            if not bid: continue
-
-            official_info, recs = await asyncio.gather(
-                get_official_beatmap_info(bid),
-                get_beatmap_recommendations_sample(bid)
-            )
-            text_part = format_beatmap_result_for_display(beatmap_from_db, recs)
-            
-            content_msg = Message()
-            if official_info and (cover_url := official_info.get("beatmapset", {}).get("covers", {}).get("cover@2x")):
-                try:
-                    content_msg.append(MessageSegment.image(cover_url))
-                except Exception as e:
-                    logger.warning(f"添加到合并转发时，发送谱面封面图失败 (bid: {bid}): {e}")
-            
-            content_msg.append(text_part)
-
-            map_node = {
+        forward_nodes = [
+            {
                 "type": "node",
-                "data": {"name": bot_name, "uin": bot_uin, "content": content_msg}
+                "data": {"name": FORWARD_NODE_NAME, "uin": bot.self_id, "content": _build_content_msg(b, info, recs)}
             }
-            forward_nodes.append(map_node)
+            for b, (info, recs) in zip(results, extras)
+        ]
 
         try:
             if event.message_type == "group":
@@ -1,15 +1,16 @@
 import httpx
-import pymysql
 import re
-from typing import Optional, Dict, Any, Tuple, List
+from typing import Optional, Dict, Any, Tuple, List, Set
 from datetime import datetime
 import asyncio
+import base64
+from operator import itemgetter
 
 from nonebot import on_command, logger, get_plugin_config
 from nonebot.params import CommandArg
 from nonebot.adapters.onebot.v11 import Message, MessageEvent, MessageSegment
 
-from .utils import get_db_connection, get_osu_token, get_official_beatmap_info, get_oracle_classification, get_proxied_http_client
+from .utils import get_pool, Cursor, MySQLError, parse_id, get_osu_token, get_official_beatmap_info_with_fetch_time, get_oracle_classification, get_proxied_http_client, get_cover_bytes, _BINDING_CACHE
 from .config import Config
 
 plugin_config = get_plugin_config(Config)
@@ -23,23 +24,111 @@ TYPE_ALIASES: Dict[str, str] = {
     "其他": "others", "其它": "others", "others": "others",
 }
 VALID_TYPES = set(TYPE_ALIASES.values())
+# 参数解析用的查找表，键统一 casefold，解析时每个词只需一次查找
+_ALIAS_LOOKUP: Dict[str, str] = {alias.casefold(): db_type for alias, db_type in TYPE_ALIASES.items()}
+
+# 后台任务引用集合
+_background_tasks: Set[asyncio.Task] = set()
+
+# 发送结果时等待封面下载的最长时间 (秒)
+COVER_WAIT_TIMEOUT_SECONDS = 0.8
+
+# --- SQL 语句 ---
+
+# 按 qqid 查询绑定的 osu! 账号
+SELECT_USER_BINDING_SQL = "SELECT osu_uid, osu_username_at_bind FROM UserBindings WHERE qqid = %s"
+
+# 写入或更新谱面的官方元数据 (依赖 BeatmapInfo.bid 为主键)
+UPSERT_BEATMAP_INFO_SQL = """
+INSERT INTO BeatmapInfo (bid, title, artist, creator_username, creator_id, diff_name, star_rating, beatmap_status, ar, od, cs, hp, length_seconds, bpm, api_data_last_fetched_at)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    title = VALUES(title), artist = VALUES(artist), creator_username = VALUES(creator_username), creator_id = VALUES(creator_id),
+    diff_name = VALUES(diff_name), star_rating = VALUES(star_rating), beatmap_status = VALUES(beatmap_status), ar = VALUES(ar), 
+    od = VALUES(od), cs = VALUES(cs), hp = VALUES(hp), length_seconds = VALUES(length_seconds), bpm = VALUES(bpm), 
+    api_data_last_fetched_at = VALUES(api_data_last_fetched_at);
+"""
+
+# 查询谱面当前生效的分类
+SELECT_BEATMAP_ANALYSIS_STATE_SQL = "SELECT determined_b_type, is_auto_typed FROM BeatmapAnalysis WHERE bid = %s"
+
+# 读取谱面的分类状态与上一次保存的 Oracle 概率，用于跳过人工分类谱面的 Oracle 分析及 Oracle 不可用时回退
+SELECT_BEATMAP_ANALYSIS_PROBS_SQL = (
+    "SELECT determined_b_type, is_auto_typed, stream_prob, jump_prob, alt_prob, tech_prob "
+    "FROM BeatmapAnalysis WHERE bid = %s"
+)
+
+# 写入或更新谱面分析结果 (依赖 BeatmapAnalysis.bid 为主键)。只有自动分类的记录才会更新分类和状态；
+# 没有新的 Oracle 结果时 (oracle_last_run_at 为 NULL) 保留原有概率，供 Oracle 不可用时回退使用
+UPSERT_BEATMAP_ANALYSIS_SQL = """
+INSERT INTO BeatmapAnalysis (bid, determined_b_type, is_auto_typed, stream_prob, jump_prob, alt_prob, tech_prob, oracle_last_run_at)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    determined_b_type = IF(is_auto_typed = 1, VALUES(determined_b_type), determined_b_type),
+    is_auto_typed = IF(is_auto_typed = 1, VALUES(is_auto_typed), is_auto_typed),
+    stream_prob = IF(VALUES(oracle_last_run_at) IS NULL, stream_prob, VALUES(stream_prob)),
+    jump_prob = IF(VALUES(oracle_last_run_at) IS NULL, jump_prob, VALUES(jump_prob)),
+    alt_prob = IF(VALUES(oracle_last_run_at) IS NULL, alt_prob, VALUES(alt_prob)),
+    tech_prob = IF(VALUES(oracle_last_run_at) IS NULL, tech_prob, VALUES(tech_prob)),
+    oracle_last_run_at = IF(VALUES(oracle_last_run_at) IS NULL, oracle_last_run_at, VALUES(oracle_last_run_at));
+"""
+
+# 将谱面加入待审核列表 (依赖 PendingBeatmapReviews.bid 为主键)。
+# 已存在且原因相同时不改动任何列，避免重复推荐产生无意义的行更新；
+# ON DUPLICATE KEY UPDATE 按顺序赋值，reason_for_pending 必须放在最后，前面的条件才能与旧值比较
+UPSERT_PENDING_REVIEW_SQL = """
+INSERT INTO PendingBeatmapReviews (bid, reason_for_pending, triggered_by_recommendation_id, added_to_queue_at)
+VALUES (%s, %s, %s, %s) ON DUPLICATE KEY UPDATE
+    triggered_by_recommendation_id = IF(reason_for_pending <=> VALUES(reason_for_pending), triggered_by_recommendation_id, VALUES(triggered_by_recommendation_id)),
+    added_to_queue_at = IF(reason_for_pending <=> VALUES(reason_for_pending), added_to_queue_at, VALUES(added_to_queue_at)),
+    reason_for_pending = VALUES(reason_for_pending);
+"""
+
+# 写入一条推荐记录
+INSERT_RECOMMENDATION_SQL = """
+INSERT INTO Recommendations (qqid, bid, osu_username_at_recommend_time, user_requested_type, 
+                             actual_recommend_type, recommendation_description, recommended_at)
+VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+
+# /推图 结果消息模板，extra_messages 为附加提示 (每条以换行结尾，可为空)
+RECOMMEND_RESPONSE_TEMPLATE = (
+    "谱面ID: {bid} ({status})\n"
+    "标题: {artist} - {title} [{version}]\n"
+    "Mapper: {creator}\n"
+    "BPM: {bpm} | ★: {stars:.2f} | 时长: {length}\n"
+    "CS: {cs} | AR: {ar} | OD: {od} | HP: {hp}\n"
+    "{url}\n"
+    "\n"
+    "分析概率: {oracle_probs}\n"
+    "谱面库当前分类: 【{db_type}】 \n"
+    "\n"
+    "你的备注: {description}\n"
+    "{extra_messages}"
+    "\n"
+    "{result}"
+)
 
 # --- 辅助函数 (模块内专用) ---
 
 async def get_user_binding_info(qqid: int) -> Optional[Dict[str, Any]]:
-    """获取用户的 osu! 绑定信息 (osu_uid, osu_username_at_bind)"""
-    conn = get_db_connection()
-    if not conn: return None
+    """获取用户的 osu! 绑定信息 (osu_uid, osu_username_at_bind)，结果会缓存一段时间"""
+    if qqid in _BINDING_CACHE:
+        return _BINDING_CACHE[qqid]
+
+    pool = await get_pool()
+    if not pool: return None
     try:
-        with conn.cursor() as cursor:
-            sql = "SELECT osu_uid, osu_username_at_bind FROM UserBindings WHERE qqid = %s"
-            cursor.execute(sql, (qqid,))
-            return cursor.fetchone()
-    except pymysql.MySQLError as e:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(SELECT_USER_BINDING_SQL, (qqid,))
+                binding_info = await cursor.fetchone()
+    except MySQLError as e:
         logger.error(f"查询用户绑定信息失败: {e}")
         return None
-    finally:
-        if conn: conn.close()
+    # 未绑定 (None) 也缓存，绑定/解绑时会主动失效
+    _BINDING_CACHE[qqid] = binding_info
+    return binding_info
 
 async def get_user_recent_beatmap_id(osu_uid: int) -> Optional[int]:
     """获取用户最近游玩的谱面ID"""
@@ -49,188 +138,193 @@ async def get_user_recent_beatmap_id(osu_uid: int) -> Optional[int]:
     headers = {"Authorization": f"Bearer {token}", "Accept": "application/json"}
     
     try:
-        async with get_proxied_http_client() as client:
-            response = await client.get(api_url, headers=headers)
-            response.raise_for_status()
-            scores = response.json()
-            if scores and isinstance(scores, list) and scores[0].get("beatmap", {}).get("id"):
-                return int(scores[0]["beatmap"]["id"])
-            logger.warning(f"用户 {osu_uid} 最近游玩记录为空或格式不正确: {scores}")
-            return None
+        client = get_proxied_http_client()
+        response = await client.get(api_url, headers=headers)
+        response.raise_for_status()
+        scores = response.json()
+        if scores and isinstance(scores, list) and scores[0].get("beatmap", {}).get("id"):
+            return int(scores[0]["beatmap"]["id"])
+        logger.warning(f"用户 {osu_uid} 最近游玩记录为空或格式不正确: {scores}")
+        return None
     except Exception as e:
         logger.error(f"获取用户 {osu_uid} 最近谱面失败: {e}")
         return None
 
-async def fetch_and_store_beatmap_info(bid: int) -> Optional[Dict[str, Any]]:
-    """获取官方谱面信息并存入 BeatmapInfo 表"""
-    official_info = await get_official_beatmap_info(bid)
-    if not official_info:
-        return None
+async def store_beatmap_info(cursor: Cursor, bid: int, official_info: Dict[str, Any], fetched_at: datetime):
+    """将官方谱面信息存入 BeatmapInfo 表，fetched_at 为这份数据从官方 API 获取的时间"""
+    beatmapset = official_info.get("beatmapset", {})
+    params = (
+        bid,
+        beatmapset.get("title", "N/A"),
+        beatmapset.get("artist", "N/A"),
+        beatmapset.get("creator"),
+        beatmapset.get("user_id"),
+        official_info.get("version", "N/A"),
+        official_info.get("difficulty_rating", 0.0),
+        official_info.get("status", "unknown"),
+        official_info.get("ar"),
+        official_info.get("accuracy"),
+        official_info.get("cs"),
+        official_info.get("drain"),
+        official_info.get("total_length"),
+        official_info.get("bpm"),
+        fetched_at
+    )
+    await cursor.execute(UPSERT_BEATMAP_INFO_SQL, params)
+
+def probs_from_analysis_row(row: Dict[str, Any]) -> Dict[str, float]:
+    """从 BeatmapAnalysis 记录中取出已保存的各类型概率 (忽略为空的列)"""
+    return {
+        type_name: float(row[f"{type_name}_prob"])
+        for type_name in ("stream", "jump", "alt", "tech")
+        if row.get(f"{type_name}_prob") is not None
+    }
+
+def determine_oracle_type(probs: Dict[str, float]) -> str:
+    """按别名归并概率，合计超过 50% 的类型即为 Oracle 判定的类型，否则为 others"""
+    normalized_probs: Dict[str, float] = {}
+    for key, prob in probs.items():
+        normalized_key = TYPE_ALIASES.get(key.lower(), key.lower())
+        if normalized_key in VALID_TYPES:
+            normalized_probs[normalized_key] = normalized_probs.get(normalized_key, 0) + prob
 
-    conn = get_db_connection()
-    if not conn: return official_info
+    for type_name, probability in normalized_probs.items():
+        if probability > 0.5:
+            return type_name
+    return "others"
 
+async def get_stored_analysis(bid: int) -> Optional[Dict[str, Any]]:
+    """读取库中谱面的分类状态与已保存的 Oracle 概率，没有记录或查询失败时返回 None"""
+    pool = await get_pool()
+    if not pool: return None
     try:
-        with conn.cursor() as cursor:
-            sql = """
-            INSERT INTO BeatmapInfo (bid, title, artist, creator_username, creator_id, diff_name, star_rating, beatmap_status, ar, od, cs, hp, length_seconds, bpm, api_data_last_fetched_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE
-                title = VALUES(title), artist = VALUES(artist), creator_username = VALUES(creator_username), creator_id = VALUES(creator_id),
-                diff_name = VALUES(diff_name), star_rating = VALUES(star_rating), beatmap_status = VALUES(beatmap_status), ar = VALUES(ar), 
-                od = VALUES(od), cs = VALUES(cs), hp = VALUES(hp), length_seconds = VALUES(length_seconds), bpm = VALUES(bpm), 
-                api_data_last_fetched_at = VALUES(api_data_last_fetched_at);
-            """
-            beatmapset = official_info.get("beatmapset", {})
-            params = (
-                bid,
-                beatmapset.get("title", "N/A"),
-                beatmapset.get("artist", "N/A"),
-                beatmapset.get("creator"),
-                beatmapset.get("user_id"),
-                official_info.get("version", "N/A"),
-                official_info.get("difficulty_rating", 0.0),
-                official_info.get("status", "unknown"),
-                official_info.get("ar"),
-                official_info.get("accuracy"),
-                official_info.get("cs"),
-                official_info.get("drain"),
-                official_info.get("total_length"),
-                official_info.get("bpm"),
-                datetime.now()
-            )
-            cursor.execute(sql, params)
-            conn.commit()
-    except pymysql.MySQLError as e:
-        logger.error(f"存储谱面信息 {bid} 到数据库失败: {e}")
-        if conn: conn.rollback()
-    finally:
-        if conn: conn.close()
-    return official_info
-
-async def get_oracle_analysis_results(bid: int) -> Tuple[Optional[Dict[str, float]], Optional[str]]:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(SELECT_BEATMAP_ANALYSIS_PROBS_SQL, (bid,))
+                return await cursor.fetchone()
+    except MySQLError as e:
+        logger.error(f"查询谱面 {bid} 已保存的分析结果失败: {e}")
+        return None
+
+async def get_oracle_analysis_results(
+    bid: int, stored_analysis: Optional[Dict[str, Any]] = None
+) -> Tuple[Optional[Dict[str, float]], List[Tuple[str, float]], str, bool]:
     """
     调用 osu!oracle API 获取原始概率，并根据规则判断类型。
-    返回 (概率字典, oracle判定的类型字符串)
+    Oracle 不可用时退回调用方已读取的 BeatmapAnalysis 记录 (stored_analysis) 中保存的概率，并按相同规则重新判断类型。
+    返回 (概率字典, 按概率降序排列的 (类型, 概率) 列表, oracle判定的类型字符串, 是否来自已保存的结果)
     """
     raw_probs = await get_oracle_classification(bid, return_raw_probs=True)
+    from_cache = False
     if not isinstance(raw_probs, dict):
-        return None, "others"
+        raw_probs = probs_from_analysis_row(stored_analysis) if stored_analysis else None
+        if not raw_probs:
+            return None, [], "others", False
+        logger.warning(f"osu!oracle 分析失败，使用谱面 {bid} 已保存的分析结果")
+        from_cache = True
 
-    if not raw_probs:
-        return raw_probs, "others"
+    sorted_probs = sorted(raw_probs.items(), key=itemgetter(1), reverse=True)
+    return raw_probs, sorted_probs, determine_oracle_type(raw_probs), from_cache
 
-    normalized_probs = {}
-    for key, prob in raw_probs.items():
-        normalized_key = TYPE_ALIASES.get(key.lower(), key.lower())
-        if normalized_key in VALID_TYPES:
-            normalized_probs[normalized_key] = normalized_probs.get(normalized_key, 0) + prob
+async def get_beatmap_analysis_state(cursor: Cursor, bid: int) -> Optional[Dict[str, Any]]:
+    """查询谱面当前生效的分类及是否为自动分类。"""
+    await cursor.execute(SELECT_BEATMAP_ANALYSIS_STATE_SQL, (bid,))
+    return await cursor.fetchone()
 
-    if not normalized_probs:
-        return raw_probs, "others"
-    
-    for type_name, probability in normalized_probs.items():
-        if probability > 0.5:
-            return raw_probs, type_name
-            
-    return raw_probs, "others"
-
-async def store_beatmap_analysis(bid: int, probs: Optional[Dict[str, float]], 
-                                 determined_type: str, is_auto_typed: bool):
+async def get_oracle_results_unless_manual(bid: int) -> Tuple[Optional[Dict[str, float]], List[Tuple[str, float]], str, bool]:
+    """
+    谱面已被管理员人工分类时跳过 Oracle 分析（结果不会影响分类），直接返回库中的分类与已保存的概率；
+    否则调用 get_oracle_analysis_results。返回值格式与 get_oracle_analysis_results 相同。
+    """
+    stored_analysis = await get_stored_analysis(bid)
+    if stored_analysis and stored_analysis.get("is_auto_typed") == 0:
+        logger.debug(f"谱面 {bid} 已人工分类，跳过 osu!oracle 分析")
+        stored_probs = probs_from_analysis_row(stored_analysis)
+        sorted_probs = sorted(stored_probs.items(), key=itemgetter(1), reverse=True)
+        return stored_probs or None, sorted_probs, stored_analysis["determined_b_type"], bool(stored_probs)
+    return await get_oracle_analysis_results(bid, stored_analysis)
+
+async def store_beatmap_analysis(cursor: Cursor, bid: int, probs: Optional[Dict[str, float]], 
+                                 determined_type: str, is_auto_typed: bool, now: datetime):
     """存储或更新 BeatmapAnalysis 表。"""
-    conn = get_db_connection()
-    if not conn: return
+    p = probs or {}
+    params = (
+        bid, determined_type, is_auto_typed,
+        p.get("stream"), p.get("jump"), p.get("alt"), p.get("tech"),
+        now if probs is not None else None
+    )
+    await cursor.execute(UPSERT_BEATMAP_ANALYSIS_SQL, params)
 
-    try:
-        with conn.cursor() as cursor:
-            # 只有当记录是自动分类时，才允许 /推图 命令更新其分类和状态
-            sql = """
-            INSERT INTO BeatmapAnalysis (bid, determined_b_type, is_auto_typed, stream_prob, jump_prob, alt_prob, tech_prob, oracle_last_run_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE
-                determined_b_type = IF(is_auto_typed = 1, VALUES(determined_b_type), determined_b_type),
-                is_auto_typed = IF(is_auto_typed = 1, VALUES(is_auto_typed), is_auto_typed),
-                stream_prob = VALUES(stream_prob),
-                jump_prob = VALUES(jump_prob),
-                alt_prob = VALUES(alt_prob),
-                tech_prob = VALUES(tech_prob),
-                oracle_last_run_at = VALUES(oracle_last_run_at);
-            """
-            p = probs or {}
-            params = (
-                bid, determined_type, is_auto_typed,
-                p.get("stream"), p.get("jump"), p.get("alt"), p.get("tech"),
-                datetime.now() if probs is not None else None
-            )
-            cursor.execute(sql, params)
-            conn.commit()
-    except pymysql.MySQLError as e:
-        logger.error(f"存储谱面分析 {bid} 到数据库失败: {e}")
-    finally:
-        if conn: conn.close()
-
-async def store_beatmap_analysis_probabilities_only(bid: int, probs: Dict[str, float]):
-    """对于已人工审核的谱面，仅更新其概率和Oracle运行时间。"""
-    conn = get_db_connection()
-    if not conn: return
-    try:
-        with conn.cursor() as cursor:
-            sql = """
-            UPDATE BeatmapAnalysis SET 
-                stream_prob = %s, jump_prob = %s, alt_prob = %s, tech_prob = %s, oracle_last_run_at = %s
-            WHERE bid = %s AND is_auto_typed = 0
-            """
-            p = probs or {}
-            params = (p.get("stream"), p.get("jump"), p.get("alt"), p.get("tech"), datetime.now(), bid)
-            cursor.execute(sql, params)
-            conn.commit()
-    except pymysql.MySQLError as e:
-        logger.error(f"仅更新谱面 {bid} 概率失败: {e}")
-    finally:
-        if conn: conn.close()
-
-async def add_to_pending_review(bid: int, reason: str, recommendation_id: Optional[int] = None):
+async def add_to_pending_review(cursor: Cursor, bid: int, reason: str, now: datetime, recommendation_id: Optional[int] = None):
     """将谱面添加到待审核列表。"""
-    conn = get_db_connection()
-    if not conn: return
-    try:
-        with conn.cursor() as cursor:
-            sql = """
-            INSERT INTO PendingBeatmapReviews (bid, reason_for_pending, triggered_by_recommendation_id, added_to_queue_at)
-            VALUES (%s, %s, %s, %s) ON DUPLICATE KEY UPDATE
-                reason_for_pending = VALUES(reason_for_pending),
-                triggered_by_recommendation_id = VALUES(triggered_by_recommendation_id),
-                added_to_queue_at = VALUES(added_to_queue_at);
-            """
-            cursor.execute(sql, (bid, reason, recommendation_id, datetime.now()))
-            conn.commit()
-    except pymysql.MySQLError as e:
-        logger.error(f"添加谱面 {bid} 到待审核列表失败: {e}")
-    finally:
-        if conn: conn.close()
+    await cursor.execute(UPSERT_PENDING_REVIEW_SQL, (bid, reason, recommendation_id, now))
 
 async def store_recommendation(
-    qqid: int, bid: int, osu_username: Optional[str],
-    user_req_type: Optional[str], actual_rec_type: str, description: str
-) -> Optional[int]:
+    cursor: Cursor, qqid: int, bid: int, osu_username: Optional[str],
+    user_req_type: Optional[str], actual_rec_type: str, description: str, now: datetime
+) -> int:
     """存储推荐记录并返回其ID。"""
-    conn = get_db_connection()
-    if not conn: return None
-    try:
-        with conn.cursor() as cursor:
-            sql = """
-            INSERT INTO Recommendations (qqid, bid, osu_username_at_recommend_time, user_requested_type, 
-                                         actual_recommend_type, recommendation_description, recommended_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(sql, (qqid, bid, osu_username, user_req_type, actual_rec_type, description, datetime.now()))
-            conn.commit()
-            return cursor.lastrowid
-    except pymysql.MySQLError as e:
-        logger.error(f"存储推荐记录失败: {e}")
-        return None
-    finally:
-        if conn: conn.close()
+    await cursor.execute(INSERT_RECOMMENDATION_SQL, (qqid, bid, osu_username, user_req_type, actual_rec_type, description, now))
+    return cursor.lastrowid
+
+async def apply_recommendation(
+    cursor: Cursor, qqid: int, bid: int, osu_username: Optional[str], user_specified_type: Optional[str],
+    description: str, raw_oracle_probabilities: Optional[Dict[str, float]], oracle_determined_type: str,
+    oracle_from_cache: bool, now: datetime
+) -> Tuple[str, str, List[str], int]:
+    """
+    根据现有分析记录、用户指定类型与 Oracle 结果确定谱面分类，并写入分析、待审与推荐记录。
+    所有语句在调用方的同一事务中执行。
+    返回 (实际推荐类型, 谱面库中的分类, 附加提示信息, 推荐记录ID)
+    """
+    actual_recommend_type: str
+    final_determined_b_type_for_db: str
+    additional_messages: List[str] = []
+
+    # 先按自动分类直接 upsert（人工分类由 ON DUPLICATE KEY UPDATE 保留），再读回生效的记录决定后续分支
+    # 来自已保存结果的概率不重复写入，也不刷新 oracle_last_run_at
+    stored_probs = None if oracle_from_cache else raw_oracle_probabilities
+    await store_beatmap_analysis(cursor, bid, stored_probs, user_specified_type or oracle_determined_type, True, now)
+    effective_analysis_info = await get_beatmap_analysis_state(cursor, bid)
+    
+    is_auto_typed_in_db = effective_analysis_info.get("is_auto_typed", 1) == 1 if effective_analysis_info else True
+    db_determined_b_type = effective_analysis_info.get("determined_b_type") if effective_analysis_info else None
+
+    if not is_auto_typed_in_db:
+        final_determined_b_type_for_db = db_determined_b_type
+        if user_specified_type:
+            actual_recommend_type = user_specified_type
+            if user_specified_type != db_determined_b_type:
+                additional_messages.append(
+                    f"此谱面已被管理员定义为【{db_determined_b_type.upper()}】类型！\n"
+                    f"记录了你的【{user_specified_type.upper()}】，但谱面库中分类不变"
+                )
+        else:
+            actual_recommend_type = db_determined_b_type
+    else:
+        if user_specified_type:
+            actual_recommend_type = user_specified_type
+            final_determined_b_type_for_db = user_specified_type
+            additional_messages.append(f"你已将这张图定为【{user_specified_type.upper()}】！")
+            if oracle_determined_type and user_specified_type != oracle_determined_type:
+                additional_messages.append(f"但osu!Oracle 分析认为此图更偏向【{oracle_determined_type.upper()}】！差异已记录")
+                await add_to_pending_review(cursor, bid, reason=f"User specified '{user_specified_type}', oracle: '{oracle_determined_type}'", now=now)
+            elif not raw_oracle_probabilities:
+                 await add_to_pending_review(cursor, bid, reason="oracle_failed_user_specified_type", now=now)
+                 additional_messages.append("osu!oracle 分析失败或未返回有效结果！")
+        else:
+            actual_recommend_type = oracle_determined_type
+            final_determined_b_type_for_db = oracle_determined_type
+            if not raw_oracle_probabilities: 
+                additional_messages.append("osu!oracle 分析失败或未返回有效结果，谱面暂定为【OTHERS】！")
+                await add_to_pending_review(cursor, bid, reason="oracle_ambiguous_or_failed_no_user_type", now=now)
+            elif oracle_determined_type == "others":
+                await add_to_pending_review(cursor, bid, reason="oracle_ambiguous_result", now=now)
+
+    recommendation_id = await store_recommendation(
+        cursor, qqid, bid, osu_username, user_specified_type, actual_recommend_type, description, now
+    )
+    return actual_recommend_type, final_determined_b_type_for_db, additional_messages, recommendation_id
 
 def parse_recommend_args(arg_text: str) -> Tuple[Optional[str], Optional[int], str]:
     """智能解析推图命令的参数，返回 (用户指定类型, bid, 备注)"""
@@ -238,28 +332,21 @@ def parse_recommend_args(arg_text: str) -> Tuple[Optional[str], Optional[int], s
     user_type: Optional[str] = None
     bid: Optional[int] = None
     description_parts: List[str] = []
-    
-    used_indices = set()
-
-    # 优先识别类型和BID
-    for i, part in enumerate(parts):
-        if part.isdigit() and bid is None:
-            bid = int(part)
-            used_indices.add(i)
-            continue
-        
-        normalized_part = part.lower()
+
+    # 单次遍历：第一个数字为BID，第一个类型别名为类型，其余部分为备注
+    for part in parts:
+        if bid is None:
+            bid = parse_id(part)
+            if bid is not None:
+                continue
+
         if user_type is None:
-            for alias, db_type in TYPE_ALIASES.items():
-                if normalized_part == alias:
-                    user_type = db_type
-                    used_indices.add(i)
-                    break
-    
-    # 剩余部分为备注
-    for i, part in enumerate(parts):
-        if i not in used_indices:
-            description_parts.append(part)
+            db_type = _ALIAS_LOOKUP.get(part.casefold())
+            if db_type is not None:
+                user_type = db_type
+                continue
+
+        description_parts.append(part)
 
     description = " ".join(description_parts) if description_parts else "TA没有填写描述！"
     
@@ -272,6 +359,8 @@ recommend_matcher = on_command("推图", aliases={"推荐图", "推荐", "rec"},
 async def handle_recommend_command(event: MessageEvent, args: Message = CommandArg()):
     """处理 /推图 命令"""
     qqid = int(event.get_user_id())
+    # 本次请求写入的所有记录共用同一时间戳
+    now = datetime.now()
 
     # --- 1. 前置绑定检查 ---
     binding_info = await get_user_binding_info(qqid)
@@ -293,134 +382,98 @@ async def handle_recommend_command(event: MessageEvent, args: Message = CommandA
         if not final_bid:
             await recommend_matcher.finish("没有找到你最近游玩的谱面！")
 
-    # --- 3. 获取并处理谱面数据 (后续逻辑保持不变) ---
-    official_beatmap_data, (raw_oracle_probabilities, oracle_determined_type) = await asyncio.gather(
-        fetch_and_store_beatmap_info(final_bid),
-        get_oracle_analysis_results(final_bid)
-    )
+    # --- 3. 获取并处理谱面数据 ---
+    # Oracle 分析耗时最长，先启动 (人工分类的谱面会跳过)，与官方信息查询并行
+    oracle_task = asyncio.create_task(get_oracle_results_unless_manual(final_bid))
+    official_beatmap_data, beatmap_fetched_at = await get_official_beatmap_info_with_fetch_time(final_bid)
 
     if not official_beatmap_data:
+        oracle_task.cancel()
         await recommend_matcher.finish(f"未能查询到谱面ID: {final_bid} 的官方信息！请检查ID是否正确")
 
-    oracle_probs_text_list = []
-    if raw_oracle_probabilities:
-        for type_name, prob_val in sorted(raw_oracle_probabilities.items(), key=lambda item: item[1], reverse=True):
-            oracle_probs_text_list.append(f"{type_name.capitalize()}: {prob_val:.2%}")
-    oracle_probs_display_text = ", ".join(oracle_probs_text_list) if oracle_probs_text_list else "无详细概率数据"
+    # 封面下载与 Oracle 分析、数据库写入并行，发送时最多再等待 COVER_WAIT_TIMEOUT_SECONDS
+    cover_url = official_beatmap_data.get("beatmapset", {}).get("covers", {}).get("cover@2x")
+    cover_task = asyncio.create_task(get_cover_bytes(cover_url))
+    _background_tasks.add(cover_task)
+    cover_task.add_done_callback(_background_tasks.discard)
 
-    if oracle_determined_type is None:
-        oracle_determined_type = "others"
+    raw_oracle_probabilities, sorted_oracle_probs, oracle_determined_type, oracle_from_cache = await oracle_task
 
-    # 4. 确定最终推荐类型和数据库操作
-    actual_recommend_type: str
-    final_determined_b_type_for_db: str
-    additional_messages: List[str] = []
-    
-    conn_check = get_db_connection()
-    existing_analysis_info = None
-    if conn_check:
-        with conn_check.cursor() as cursor:
-            cursor.execute("SELECT determined_b_type, is_auto_typed FROM BeatmapAnalysis WHERE bid = %s", (final_bid,))
-            existing_analysis_info = cursor.fetchone()
-        conn_check.close()
-    
-    is_auto_typed_in_db = existing_analysis_info.get("is_auto_typed", 1) == 1 if existing_analysis_info else True
-    db_determined_b_type = existing_analysis_info.get("determined_b_type") if existing_analysis_info else None
-
-    if not is_auto_typed_in_db:
-        final_determined_b_type_for_db = db_determined_b_type
-        if user_specified_type:
-            actual_recommend_type = user_specified_type
-            if user_specified_type != db_determined_b_type:
-                additional_messages.append(
-                    f"此谱面已被管理员定义为【{db_determined_b_type.upper()}】类型！\n"
-                    f"记录了你的【{user_specified_type.upper()}】，但谱面库中分类不变"
-                )
-        else:
-            actual_recommend_type = db_determined_b_type
-        if raw_oracle_probabilities is not None:
-             await store_beatmap_analysis_probabilities_only(final_bid, raw_oracle_probabilities)
-    else:
-        if user_specified_type:
-            actual_recommend_type = user_specified_type
-            final_determined_b_type_for_db = user_specified_type
-            additional_messages.append(f"你已将这张图定为【{user_specified_type.upper()}】！")
-            if oracle_determined_type and user_specified_type != oracle_determined_type:
-                additional_messages.append(f"但osu!Oracle 分析认为此图更偏向【{oracle_determined_type.upper()}】！差异已记录")
-                await add_to_pending_review(final_bid, reason=f"User specified '{user_specified_type}', oracle: '{oracle_determined_type}'")
-            elif not raw_oracle_probabilities:
-                 await add_to_pending_review(final_bid, reason="oracle_failed_user_specified_type")
-                 additional_messages.append("osu!oracle 分析失败或未返回有效结果！")
-        else:
-            actual_recommend_type = oracle_determined_type
-            final_determined_b_type_for_db = oracle_determined_type
-            if not raw_oracle_probabilities: 
-                additional_messages.append("osu!oracle 分析失败或未返回有效结果，谱面暂定为【OTHERS】！")
-                await add_to_pending_review(final_bid, reason="oracle_ambiguous_or_failed_no_user_type")
-            elif oracle_determined_type == "others":
-                await add_to_pending_review(final_bid, reason="oracle_ambiguous_result")
-        await store_beatmap_analysis(final_bid, raw_oracle_probabilities, final_determined_b_type_for_db, True)
+    oracle_probs_display_text = ", ".join(
+        f"{type_name.capitalize()}: {prob_val:.2%}" for type_name, prob_val in sorted_oracle_probs
+    ) or "无详细概率数据"
+    if oracle_from_cache:
+        oracle_probs_display_text += " (cached)"
 
-    # 5. 存储推荐并反馈
+    # 4. 确定最终推荐类型，并在同一连接、同一事务中写入谱面信息、分析、待审与推荐记录
     osu_username_for_rec = binding_info.get("osu_username_at_bind") # 直接使用已获取的绑定信息
-    
-    recommendation_id = await store_recommendation(
-        qqid, final_bid, osu_username_for_rec, user_specified_type, actual_recommend_type, description_from_arg
-    )
-    
-    if recommendation_id is None:
+    recommendation_result = None
+    pool = await get_pool()
+    if pool:
+        try:
+            async with pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await conn.begin()
+                    try:
+                        # 谱面信息最先写入，保证后续引用该 bid 的记录写入时它已存在
+                        await store_beatmap_info(
+                            cursor, final_bid, official_beatmap_data, datetime.fromtimestamp(beatmap_fetched_at)
+                        )
+                        recommendation_result = await apply_recommendation(
+                            cursor, qqid, final_bid, osu_username_for_rec, user_specified_type,
+                            description_from_arg, raw_oracle_probabilities, oracle_determined_type, oracle_from_cache, now
+                        )
+                        await conn.commit()
+                    except MySQLError:
+                        await conn.rollback()
+                        raise
+        except MySQLError as e:
+            logger.error(f"存储谱面 {final_bid} 的推荐记录失败: {e}")
+            recommendation_result = None
+
+    # 5. 存储结果反馈
+    if recommendation_result is None:
         await recommend_matcher.send("存储推荐记录到数据库失败，请联系YRScarlet！")
         return
 
-    # 6. 构建并发送最终消息
-    title = official_beatmap_data.get("beatmapset", {}).get("title", "N/A")
-    artist = official_beatmap_data.get("beatmapset", {}).get("artist", "N/A")
-    version = official_beatmap_data.get("version", "N/A")
-    creator = official_beatmap_data.get("beatmapset", {}).get("creator", "N/A")
-    status = official_beatmap_data.get("status", "N/A").capitalize()
-    bpm = official_beatmap_data.get("bpm", "N/A")
-    cs = official_beatmap_data.get("cs", "N/A")
-    ar = official_beatmap_data.get("ar", "N/A")
-    od = official_beatmap_data.get("accuracy", "N/A")
-    hp = official_beatmap_data.get("drain", "N/A")
-    stars = float(official_beatmap_data.get("difficulty_rating", 0.0))
-    length_seconds = official_beatmap_data.get("total_length") 
-    length_str = f"{length_seconds // 60}m{length_seconds % 60}s" if length_seconds is not None else "N/A"
-    beatmap_url = official_beatmap_data.get("url", f"https://osu.ppy.sh/b/{final_bid}")
-    cover_url = official_beatmap_data.get("beatmapset", {}).get("covers", {}).get("cover@2x")
-
-    response_parts = [
-        f"谱面ID: {final_bid} ({status})",
-        f"标题: {artist} - {title} [{version}]",
-        f"Mapper: {creator}",
-        f"BPM: {bpm} | ★: {stars:.2f} | 时长: {length_str}",
-        f"CS: {cs} | AR: {ar} | OD: {od} | HP: {hp}",
-        f"{beatmap_url}",
-        "",
-        f"分析概率: {oracle_probs_display_text}",
-        f"谱面库当前分类: 【{final_determined_b_type_for_db.upper()}】 ",
-        "",
-        f"你的备注: {description_from_arg}"
-    ]
-    
-    if additional_messages:
-        response_parts.extend(additional_messages)
+    actual_recommend_type, final_determined_b_type_for_db, additional_messages, _ = recommendation_result
 
+    # 6. 构建并发送最终消息
+    beatmapset = official_beatmap_data.get("beatmapset", {})
+    length_seconds = official_beatmap_data.get("total_length")
     is_type_match_success = (user_specified_type and user_specified_type == actual_recommend_type) or \
                             (not user_specified_type and actual_recommend_type != "others" and raw_oracle_probabilities)
 
-    response_parts.append("")
-    if is_type_match_success:
-        response_parts.append("✔ 推荐已成功记录，谱面信息已更新！")
-    else:
-        response_parts.append("✔ 推荐已记录")
-
-    final_response_text = "\n".join(response_parts)
+    final_response_text = RECOMMEND_RESPONSE_TEMPLATE.format_map({
+        "bid": final_bid,
+        "status": official_beatmap_data.get("status", "N/A").capitalize(),
+        "artist": beatmapset.get("artist", "N/A"),
+        "title": beatmapset.get("title", "N/A"),
+        "version": official_beatmap_data.get("version", "N/A"),
+        "creator": beatmapset.get("creator", "N/A"),
+        "bpm": official_beatmap_data.get("bpm", "N/A"),
+        "stars": float(official_beatmap_data.get("difficulty_rating", 0.0)),
+        "length": f"{length_seconds // 60}m{length_seconds % 60}s" if length_seconds is not None else "N/A",
+        "cs": official_beatmap_data.get("cs", "N/A"),
+        "ar": official_beatmap_data.get("ar", "N/A"),
+        "od": official_beatmap_data.get("accuracy", "N/A"),
+        "hp": official_beatmap_data.get("drain", "N/A"),
+        "url": official_beatmap_data.get("url", f"https://osu.ppy.sh/b/{final_bid}"),
+        "oracle_probs": oracle_probs_display_text,
+        "db_type": final_determined_b_type_for_db.upper(),
+        "description": description_from_arg,
+        "extra_messages": "".join(f"{message}\n" for message in additional_messages),
+        "result": "✔ 推荐已成功记录，谱面信息已更新！" if is_type_match_success else "✔ 推荐已记录",
+    })
     response_msg = Message()
-    if cover_url:
-        try:
-            response_msg.append(MessageSegment.image(cover_url))
-        except Exception as e:
-            logger.warning(f"发送谱面封面图失败: {e}")
+    # 只发送已下载成功的封面；超时或失败时只发文字，避免客户端显示无法加载的图片。
+    # shield 使超时后下载继续进行，完成后写入缓存供下次使用
+    try:
+        cover_bytes = await asyncio.wait_for(asyncio.shield(cover_task), COVER_WAIT_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        logger.info(f"谱面 {final_bid} 的封面未能在 {COVER_WAIT_TIMEOUT_SECONDS}s 内下载完成，仅发送文字")
+        cover_bytes = None
+    if cover_bytes:
+        response_msg.append(MessageSegment.image(f"base64://{base64.b64encode(cover_bytes).decode()}"))
     response_msg.append(final_response_text)
     await recommend_matcher.send(response_msg)
\ No newline at end of file
@@ -1,13 +1,68 @@
 import httpx
-import pymysql
+import asyncmy
+import asyncio
 import time
-from typing import Optional, Dict, Any, Union
+import orjson
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+from cachetools import TTLCache
+from asyncmy.constants import CLIENT
+from asyncmy.cursors import Cursor, DictCursor
+from asyncmy.errors import MySQLError
+from asyncmy.pool import Pool
+from typing import Optional, Dict, Any, Union, List, Tuple, Set
 
-from nonebot import logger, get_plugin_config
+from nonebot import logger, get_plugin_config, get_driver
 from .config import Config
 
 # 获取插件配置实例
 plugin_config = get_plugin_config(Config)
+driver = get_driver()
+
+# 全局数据库连接池，由 get_pool() 懒加载创建
+_DB_POOL: Optional[Pool] = None
+# 模块内共享的异步锁 (名称 -> 锁)，由 _get_lock() 懒加载创建
+_LOCKS: Dict[str, asyncio.Lock] = {}
+
+# 全局共享的 HTTP 客户端，由 get_proxied_http_client() 懒加载创建
+_HTTP_CLIENT: Optional[httpx.AsyncClient] = None
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+HTTP_MAX_CONNECTIONS = 100
+
+# 全局 Redis 客户端，未配置 redis_url 时不启用缓存
+_REDIS: Optional[aioredis.Redis] = None
+# Redis 只是可选缓存：连接或读写超过该时间即视为不可用 (抛出 RedisError，按未命中处理)
+REDIS_SOCKET_TIMEOUT_SECONDS = 0.5
+# 区分“缓存未命中”与“缓存了 None (负缓存)”
+_CACHE_MISS = object()
+
+# 谱面信息缓存时间：Ranked/Approved/Loved 的元数据基本不会再变，其余状态可能随时更新
+BEATMAP_CACHE_STABLE_STATUSES = {"ranked", "approved", "loved"}
+BEATMAP_CACHE_TTL_STABLE_SECONDS = 7 * 24 * 3600
+BEATMAP_CACHE_TTL_VOLATILE_SECONDS = 60
+BEATMAP_CACHE_TTL_NOT_FOUND_SECONDS = 30
+
+# osu!oracle 分类缓存：新鲜期内直接使用；过期后仅在 Oracle 不可用时作为兜底
+ORACLE_CACHE_FRESH_SECONDS = 24 * 3600
+ORACLE_CACHE_STALE_TTL_SECONDS = 7 * 24 * 3600
+
+# osu!oracle 合并查询：在 30ms 窗口内收集并发的查询，一次请求最多携带 32 个 bid
+ORACLE_BATCH_WINDOW_SECONDS = 0.03
+ORACLE_BATCH_MAX_SIZE = 32
+# 队列在首次查询时创建
+_oracle_queue: Optional["asyncio.Queue[int]"] = None
+# 正在查询中的 bid -> 结果 Future，同一谱面的并发查询共享一次请求
+_oracle_pending: Dict[int, "asyncio.Future[Tuple[Optional[Dict[str, float]], str]]"] = {}
+_oracle_worker_task: Optional[asyncio.Task] = None
+_oracle_batch_tasks: Set[asyncio.Task] = set()
+
+# 谱面封面图片缓存 (进程内)，同一 URL 的封面内容基本不会变化。
+# 按图片字节数计算容量 (cover@2x 通常为 150–400 KB)，每个进程最多占用 64 MB
+COVER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+COVER_CACHE: TTLCache = TTLCache(maxsize=COVER_CACHE_MAX_BYTES, ttl=24 * 3600, getsizeof=len)
+
+# 用户绑定信息缓存 (qqid -> 绑定信息)。绑定关系很少变化，且本进程内的绑定/解绑会主动失效
+_BINDING_CACHE: TTLCache = TTLCache(maxsize=10_000, ttl=600)
 
 # 用于缓存 Access Token 及其过期时间，避免重复请求
 OSU_TOKEN_CACHE: Dict[str, Any] = {
@@ -16,38 +71,181 @@ OSU_TOKEN_CACHE: Dict[str, Any] = {
 }
 # 提前 5 分钟刷新 token，防止在临界点失效
 OSU_TOKEN_REFRESH_BEFORE_EXPIRY_SECONDS = 300
+# 多个 worker 之间通过 Redis 共享 token
+OSU_TOKEN_REDIS_KEY = "osu:token"
+# 后台任务在过期前 10 分钟主动刷新；刷新失败时 1 分钟后重试
+OSU_TOKEN_PROACTIVE_REFRESH_SECONDS = 600
+OSU_TOKEN_RETRY_INTERVAL_SECONDS = 60
+_token_refresh_task: Optional[asyncio.Task] = None
 
 
-def get_db_connection() -> Optional[pymysql.connections.Connection]:
+def parse_id(text: str) -> Optional[int]:
     """
-    建立并返回一个数据库连接。
+    将纯数字字符串解析为非负整数 ID。
     
-    :return: pymysql 连接对象，如果失败则返回 None。
+    :return: 解析得到的整数；包含非 ASCII 数字、符号或空白时返回 None。
     """
-    try:
-        conn = pymysql.connect(
-            host=plugin_config.db_host,
-            port=plugin_config.db_port,
-            user=plugin_config.db_user,
-            password=plugin_config.db_password,
-            database=plugin_config.db_name,
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor  # 使查询结果以字典形式返回
+    return int(text) if text.isascii() and text.isdecimal() else None
+
+
+def _get_lock(name: str) -> asyncio.Lock:
+    """
+    返回指定名称的共享锁，首次调用时创建。
+    锁必须在运行中的事件循环内创建：Python 3.9 下 Lock 会绑定创建时的事件循环，模块导入时创建会导致跨循环错误。
+    """
+    lock = _LOCKS.get(name)
+    if lock is None:
+        lock = _LOCKS[name] = asyncio.Lock()
+    return lock
+
+
+async def get_pool() -> Optional[Pool]:
+    """
+    获取全局 asyncmy 连接池，首次调用时创建。
+
+    :return: asyncmy 连接池，如果创建失败则返回 None。
+    """
+    global _DB_POOL
+    if _DB_POOL is not None:
+        return _DB_POOL
+
+    async with _get_lock("db_pool"):
+        # 等待锁期间可能已被其他协程创建
+        if _DB_POOL is None:
+            try:
+                _DB_POOL = await asyncmy.create_pool(
+                    host=plugin_config.db_host,
+                    port=plugin_config.db_port,
+                    user=plugin_config.db_user,
+                    password=plugin_config.db_password,
+                    database=plugin_config.db_name,
+                    minsize=plugin_config.db_pool_minsize,
+                    maxsize=plugin_config.db_pool_maxsize,
+                    # 单条语句自动提交；多语句写入通过 conn.begin() 显式开启事务。
+                    # 若关闭 autocommit，只读查询也会隐式开启事务并持有旧快照，连接复用时可能读到过期数据。
+                    autocommit=True,
+                    charset='utf8mb4',
+                    # FOUND_ROWS: UPDATE 返回匹配行数而非实际变更行数，可直接用于判断记录是否存在
+                    client_flag=CLIENT.FOUND_ROWS,
+                    cursor_cls=DictCursor,  # 使查询结果以字典形式返回
+                )
+                logger.info("数据库连接池已创建")
+            except MySQLError as e:
+                logger.error(f"创建数据库连接池失败: {e}")
+                return None
+    return _DB_POOL
+
+
+async def fetch_all_as_dicts(cursor: Cursor) -> List[Dict[str, Any]]:
+    """
+    读取元组游标的全部结果并组装为字典列表。
+    列名只从 cursor.description 解析一次，比 DictCursor 逐行构造字典更省开销。
+    """
+    rows = await cursor.fetchall()
+    if not rows:
+        return []
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in rows]
+
+
+@driver.on_startup
+async def _init_db_pool():
+    """启动时预热连接池，避免首个命令承担建连开销"""
+    await get_pool()
+
+
+@driver.on_shutdown
+async def _close_db_pool():
+    """关闭时释放连接池中的所有连接"""
+    global _DB_POOL
+    if _DB_POOL is not None:
+        _DB_POOL.close()
+        await _DB_POOL.wait_closed()
+        _DB_POOL = None
+
+
+def get_redis() -> Optional[aioredis.Redis]:
+    """
+    获取全局 Redis 客户端。连接在首次执行命令时才会真正建立。
+    
+    :return: Redis 客户端，如果未配置 redis_url 则返回 None。
+    """
+    global _REDIS
+    if _REDIS is None and plugin_config.redis_url:
+        _REDIS = aioredis.from_url(
+            plugin_config.redis_url,
+            socket_timeout=REDIS_SOCKET_TIMEOUT_SECONDS,
+            socket_connect_timeout=REDIS_SOCKET_TIMEOUT_SECONDS,
         )
-        return conn
-    except pymysql.MySQLError as e:
-        logger.error(f"数据库连接失败: {e}")
-        return None
+    return _REDIS
+
+
+@driver.on_shutdown
+async def _close_redis():
+    """关闭时断开 Redis 连接"""
+    global _REDIS
+    if _REDIS is not None:
+        await _REDIS.aclose()
+        _REDIS = None
+
+
+async def cache_get(key: str) -> Any:
+    """
+    从 Redis 读取 JSON 缓存。Redis 不可用时视为未命中。
+    
+    :return: 反序列化后的值 (可能为 None，表示负缓存)；未命中时返回 _CACHE_MISS。
+    """
+    redis = get_redis()
+    if not redis:
+        return _CACHE_MISS
+    try:
+        raw = await redis.get(key)
+    except RedisError as e:
+        logger.warning(f"读取 Redis 缓存 {key} 失败: {e}")
+        return _CACHE_MISS
+    return _CACHE_MISS if raw is None else orjson.loads(raw)
+
+
+async def cache_set(key: str, value: Any, ttl: int) -> None:
+    """将值以 JSON 形式写入 Redis 并设置过期时间，失败时仅记录日志。"""
+    redis = get_redis()
+    if not redis:
+        return
+    try:
+        await redis.set(key, orjson.dumps(value), ex=ttl)
+    except RedisError as e:
+        logger.warning(f"写入 Redis 缓存 {key} 失败: {e}")
+
+
+async def cache_delete(key: str) -> None:
+    """删除 Redis 中的缓存键，失败时仅记录日志。"""
+    redis = get_redis()
+    if not redis:
+        return
+    try:
+        await redis.delete(key)
+    except RedisError as e:
+        logger.warning(f"删除 Redis 缓存 {key} 失败: {e}")
 
 
 def get_proxied_http_client() -> httpx.AsyncClient:
     """
-    根据配置创建并返回一个支持代理的 httpx.AsyncClient。
+    返回全局共享的、支持代理的 httpx.AsyncClient，首次调用时创建。
+    所有请求复用同一个连接池，避免每次调用都重新进行 TCP/TLS 握手。
+    调用方不应关闭它，插件关闭时会统一释放。
     
     :return: 配置好的 httpx.AsyncClient 实例。
     """
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is not None and not _HTTP_CLIENT.is_closed:
+        return _HTTP_CLIENT
+
     proxy_url_to_use = None
     mounts_config = None
+    limits = httpx.Limits(
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        max_connections=HTTP_MAX_CONNECTIONS,
+    )
 
     if plugin_config.all_proxy:
         proxy_url_to_use = plugin_config.all_proxy
@@ -57,20 +255,27 @@ def get_proxied_http_client() -> httpx.AsyncClient:
         proxy_url_to_use = plugin_config.http_proxy
 
     if proxy_url_to_use:
-        transport_with_proxy = httpx.AsyncHTTPTransport(proxy=proxy_url_to_use)
+        # 挂载的 transport 不继承 client 的 limits，需要单独传入
+        transport_with_proxy = httpx.AsyncHTTPTransport(proxy=proxy_url_to_use, limits=limits, http2=True)
         mounts_config = {"all://": transport_with_proxy}
     
     # trust_env=False 确保不使用系统环境变量中的代理，完全由配置控制
-    return httpx.AsyncClient(mounts=mounts_config, timeout=20.0, trust_env=False)
+    # http2=True 允许对同一主机的并发请求在一条连接上多路复用 (需要 h2)
+    _HTTP_CLIENT = httpx.AsyncClient(mounts=mounts_config, limits=limits, http2=True, timeout=20.0, trust_env=False)
+    return _HTTP_CLIENT
 
 
-async def get_osu_token() -> Optional[str]:
-    """
-    获取 osu! API v2 Access Token。
-    优先从缓存中读取，如果 Token 不存在或即将过期，则重新请求。
-    
-    :return:有效的 Access Token 字符串，如果失败则返回 None。
-    """
+@driver.on_shutdown
+async def _close_http_client():
+    """关闭时释放共享 HTTP 连接池"""
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is not None:
+        await _HTTP_CLIENT.aclose()
+        _HTTP_CLIENT = None
+
+
+async def _get_cached_osu_token() -> Optional[str]:
+    """从进程内缓存或 Redis 共享缓存中读取仍然有效的 Access Token，没有则返回 None。"""
     current_time = time.time()
     
     # 检查缓存中的 token 是否仍然有效
@@ -79,6 +284,19 @@ async def get_osu_token() -> Optional[str]:
         logger.debug("使用已缓存的 osu! API Access Token")
         return OSU_TOKEN_CACHE["access_token"]
 
+    # 其他 worker 可能已经获取过 token
+    shared_token = await cache_get(OSU_TOKEN_REDIS_KEY)
+    if (shared_token is not _CACHE_MISS and shared_token and
+            shared_token["expires_at"] > current_time + OSU_TOKEN_REFRESH_BEFORE_EXPIRY_SECONDS):
+        logger.debug("使用 Redis 中共享的 osu! API Access Token")
+        OSU_TOKEN_CACHE.update(shared_token)
+        return shared_token["access_token"]
+
+    return None
+
+
+async def _refresh_osu_token() -> Optional[str]:
+    """向 osu! 请求新的 Access Token 并写入缓存。调用方需持有 Token 刷新锁。"""
     if not plugin_config.osu_client_id or not plugin_config.osu_client_secret:
         logger.error("osu! Client ID 或 Client Secret 未配置！")
         return None
@@ -96,24 +314,27 @@ async def get_osu_token() -> Optional[str]:
     }
 
     try:
-        async with get_proxied_http_client() as client:
-            logger.info("正在尝试获取新的 osu! API Access Token...")
-            response = await client.post(token_url, data=payload, headers=headers)
-            response.raise_for_status()
-            token_data = response.json()
-            
-            access_token = token_data.get("access_token")
-            expires_in = token_data.get("expires_in", 0)
-
-            if access_token:
-                # 更新缓存
-                OSU_TOKEN_CACHE["access_token"] = access_token
-                OSU_TOKEN_CACHE["expires_at"] = time.time() + expires_in
-                logger.info("成功获取并缓存 osu! API Access Token")
-                return access_token
-            else:
-                logger.error("未能从 osu! API 响应中获取 access_token")
-                return None
+        client = get_proxied_http_client()
+        logger.info("正在尝试获取新的 osu! API Access Token...")
+        response = await client.post(token_url, data=payload, headers=headers)
+        response.raise_for_status()
+        token_data = response.json()
+
+        access_token = token_data.get("access_token")
+        expires_in = token_data.get("expires_in", 0)
+
+        if access_token:
+            # 更新缓存
+            OSU_TOKEN_CACHE["access_token"] = access_token
+            OSU_TOKEN_CACHE["expires_at"] = time.time() + expires_in
+            shared_ttl = int(expires_in) - OSU_TOKEN_REFRESH_BEFORE_EXPIRY_SECONDS
+            if shared_ttl > 0:
+                await cache_set(OSU_TOKEN_REDIS_KEY, dict(OSU_TOKEN_CACHE), shared_ttl)
+            logger.info("成功获取并缓存 osu! API Access Token")
+            return access_token
+        else:
+            logger.error("未能从 osu! API 响应中获取 access_token")
+            return None
     except httpx.HTTPStatusError as e:
         logger.error(f"获取 osu! Token HTTP 错误: {e.response.status_code} - {e.response.text}")
     except Exception as e:
@@ -122,16 +343,85 @@ async def get_osu_token() -> Optional[str]:
     return None
 
 
+async def get_osu_token() -> Optional[str]:
+    """
+    获取 osu! API v2 Access Token。
+    优先从缓存中读取，如果 Token 不存在或即将过期，则重新请求。
+    刷新过程加锁，并发请求只会触发一次刷新，其余请求等待后直接读取缓存。
+    
+    :return:有效的 Access Token 字符串，如果失败则返回 None。
+    """
+    token = await _get_cached_osu_token()
+    if token:
+        return token
+
+    async with _get_lock("osu_token"):
+        # 等待锁期间其他协程可能已经完成刷新
+        token = await _get_cached_osu_token()
+        if token:
+            return token
+        return await _refresh_osu_token()
+
+
+async def _osu_token_refresher() -> None:
+    """后台循环在 Token 过期前主动刷新，使用户请求始终命中缓存"""
+    while True:
+        async with _get_lock("osu_token"):
+            # 其他 worker 可能已经刷新并共享了 token，仍足够新时直接沿用，避免覆盖 Redis 中的 token
+            token = await _get_cached_osu_token()
+            if not token or OSU_TOKEN_CACHE["expires_at"] <= time.time() + OSU_TOKEN_PROACTIVE_REFRESH_SECONDS:
+                await _refresh_osu_token()
+        delay = OSU_TOKEN_CACHE["expires_at"] - time.time() - OSU_TOKEN_PROACTIVE_REFRESH_SECONDS
+        await asyncio.sleep(max(delay, OSU_TOKEN_RETRY_INTERVAL_SECONDS))
+
+
+@driver.on_startup
+async def _start_osu_token_refresher():
+    """配置了 osu! 凭据时启动 Token 刷新任务"""
+    global _token_refresh_task
+    if plugin_config.osu_client_id and plugin_config.osu_client_secret:
+        _token_refresh_task = asyncio.create_task(_osu_token_refresher())
+
+
+@driver.on_shutdown
+async def _stop_osu_token_refresher():
+    """关闭时取消 Token 刷新任务"""
+    if _token_refresh_task:
+        _token_refresh_task.cancel()
+
+
 async def get_official_beatmap_info(beatmap_id: int) -> Optional[Dict[str, Any]]:
     """
     根据 beatmap_id 从 osu! 官方 API 查询谱面信息。
+    优先读取 Redis 缓存，未命中时请求 API 并回写缓存。
     
     :param beatmap_id: 谱面ID。
     :return: 包含谱面信息的字典，如果失败则返回 None。
     """
+    beatmap_data, _ = await get_official_beatmap_info_with_fetch_time(beatmap_id)
+    return beatmap_data
+
+
+async def get_official_beatmap_info_with_fetch_time(beatmap_id: int) -> Tuple[Optional[Dict[str, Any]], Optional[float]]:
+    """
+    与 get_official_beatmap_info 相同，但同时返回这份数据实际从官方 API 获取的时间，
+    命中缓存时为当初请求 API 的时间而不是当前时间。
+    
+    :param beatmap_id: 谱面ID。
+    :return: (谱面信息, 获取时间戳)，失败时返回 (None, None)。
+    """
+    cache_key = f"osu:beatmap:{beatmap_id}"
+    # 缓存值为 {"fetched_at": 时间戳, "beatmap": 谱面信息}，负缓存为 None
+    cached = await cache_get(cache_key)
+    if cached is not _CACHE_MISS:
+        logger.debug(f"使用已缓存的谱面信息 (bid: {beatmap_id})")
+        if cached is None:
+            return None, None
+        return cached["beatmap"], cached["fetched_at"]
+
     token = await get_osu_token()
     if not token:
-        return None
+        return None, None
 
     api_url = f"https://osu.ppy.sh/api/v2/beatmaps/{beatmap_id}"
     headers = {
@@ -142,76 +432,239 @@ async def get_official_beatmap_info(beatmap_id: int) -> Optional[Dict[str, Any]]
     
     logger.info(f"正在从官方 API 获取谱面信息 (bid: {beatmap_id})")
     try:
-        async with get_proxied_http_client() as client:
-            response = await client.get(api_url, headers=headers)
-            response.raise_for_status()
-            return response.json()
+        client = get_proxied_http_client()
+        response = await client.get(api_url, headers=headers)
+        response.raise_for_status()
+        beatmap_data = response.json()
     except httpx.HTTPStatusError as e:
         if e.response.status_code == 401:  # Token 失效
             logger.warning("获取谱面信息时遇到401错误，Token可能已过期，将强制刷新后重试...")
             OSU_TOKEN_CACHE["expires_at"] = 0  # 强制使缓存过期
+            await cache_delete(OSU_TOKEN_REDIS_KEY)
             # 不再需要手动重试逻辑，下次调用 get_osu_token() 会自动刷新
+        elif e.response.status_code == 404:  # 负缓存，避免无效 bid 反复请求 API
+            await cache_set(cache_key, None, BEATMAP_CACHE_TTL_NOT_FOUND_SECONDS)
         logger.error(f"查询谱面信息 HTTP 错误: {e.response.status_code} - {e.response.text}")
+        return None, None
     except Exception as e:
         logger.error(f"查询谱面信息时发生未知错误: {e}")
-        
-    return None
+        return None, None
 
+    if beatmap_data.get("status") in BEATMAP_CACHE_STABLE_STATUSES:
+        ttl = BEATMAP_CACHE_TTL_STABLE_SECONDS
+    else:
+        ttl = BEATMAP_CACHE_TTL_VOLATILE_SECONDS
+    fetched_at = time.time()
+    await cache_set(cache_key, {"fetched_at": fetched_at, "beatmap": beatmap_data}, ttl)
+    return beatmap_data, fetched_at
 
-async def get_oracle_classification(beatmap_id: int, return_raw_probs: bool = False) -> Optional[Union[str, Dict[str, float]]]:
+
+async def get_cover_bytes(cover_url: Optional[str]) -> Optional[bytes]:
     """
-    根据 beatmap_id 查询 osu!oracle 的谱面分类。
+    下载谱面封面图片，结果缓存在进程内，供以 base64 形式直接发送。
     
-    :param beatmap_id: 谱面ID。
-    :param return_raw_probs: 若为 True，返回原始概率字典；否则返回格式化后的字符串。
-    :return: 格式化字符串、概率字典或在失败时返回特定错误字符串/None。
+    :param cover_url: 封面图片 URL。
+    :return: 图片内容，URL 为空或下载失败时返回 None。
     """
-    if not plugin_config.osu_oracle_api_url:
-        logger.warning("osu!oracle API URL 未在配置中设置。")
-        return "查询失败 (Oracle API未配置)" if not return_raw_probs else None
+    if not cover_url:
+        return None
+    cached = COVER_CACHE.get(cover_url)
+    if cached is not None:
+        return cached
+
+    try:
+        client = get_proxied_http_client()
+        response = await client.get(cover_url)
+        response.raise_for_status()
+    except Exception as e:
+        logger.warning(f"下载谱面封面失败 ({cover_url}): {e}")
+        return None
+
+    # 超过缓存总容量的单张图片不缓存 (TTLCache 会抛出 ValueError)
+    if len(response.content) <= COVER_CACHE_MAX_BYTES:
+        COVER_CACHE[cover_url] = response.content
+    return response.content
+
+
+def invalidate_user_binding_cache(qqid: int):
+    """绑定关系变更后清除该用户的缓存"""
+    _BINDING_CACHE.pop(qqid, None)
+
+
+async def _oracle_cache_get(cache_key: str) -> Optional[Tuple[float, Dict[str, float]]]:
+    """读取 Oracle 分类缓存 (Redis 哈希: fetched_at + body)，未命中或 Redis 不可用时返回 None。"""
+    redis = get_redis()
+    if not redis:
+        return None
+    try:
+        cached = await redis.hgetall(cache_key)
+    except RedisError as e:
+        logger.warning(f"读取 Redis 缓存 {cache_key} 失败: {e}")
+        return None
+    if not cached or b"fetched_at" not in cached or b"body" not in cached:
+        return None
+    return float(cached[b"fetched_at"]), orjson.loads(cached[b"body"])
+
+
+async def _oracle_cache_set(cache_key: str, predictions: Dict[str, float]) -> None:
+    """写入 Oracle 分类缓存，失败时仅记录日志。"""
+    redis = get_redis()
+    if not redis:
+        return
+    try:
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.hset(cache_key, mapping={"fetched_at": time.time(), "body": orjson.dumps(predictions)})
+            pipe.expire(cache_key, ORACLE_CACHE_STALE_TTL_SECONDS)
+            await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"写入 Redis 缓存 {cache_key} 失败: {e}")
+
+
+async def _request_oracle_predictions(beatmap_ids: List[int]) -> Dict[int, Tuple[Optional[Dict[str, float]], str]]:
+    """
+    在一次请求中向 osu!oracle 查询多个谱面的原始概率。
+    
+    :return: bid -> (概率字典, 提示文本)。请求失败时概率字典为 None；Oracle 无该谱面结果时为空字典。
+    """
+    def fail_all(hint: str) -> Dict[int, Tuple[Optional[Dict[str, float]], str]]:
+        return {bid: (None, hint) for bid in beatmap_ids}
 
-    payload = {"beatmap_ids": [str(beatmap_id)]}
+    payload = {"beatmap_ids": [str(bid) for bid in beatmap_ids]}
 
     try:
-        async with get_proxied_http_client() as client:
-            logger.info(f"向 osu!oracle 查询 bid: {beatmap_id}")
-            # 增加超时时间以应对模型预测耗时
-            response = await client.post(plugin_config.osu_oracle_api_url, json=payload, timeout=30.0)
-            response.raise_for_status()
-            data = response.json()
-
-            # 处理 API 可能的错误返回格式
-            if "error" in data:
-                logger.error(f"osu!oracle API 返回错误: {data['error']}")
-                return "查询失败 (Oracle API错误)" if not return_raw_probs else None
-            if "detail" in data:
-                error_detail = data['detail'][0]['msg'] if isinstance(data['detail'], list) else data['detail']
-                logger.error(f"osu!oracle API 请求体错误: {error_detail}")
-                return "查询失败 (Oracle API请求错误)" if not return_raw_probs else None
-
-            beatmap_id_str = str(beatmap_id)
-            if beatmap_id_str in data and isinstance(data[beatmap_id_str], dict):
-                predictions = data[beatmap_id_str]
-                if return_raw_probs:
-                    return predictions
-
-                if not predictions:
-                    return "未知类型 (Oracle无详细分类)"
-                
-                sorted_predictions = sorted(predictions.items(), key=lambda item: item[1], reverse=True)
-                details = [f"{name.capitalize()}: {prob:.2%}" for name, prob in sorted_predictions]
-                
-                return ", ".join(details) if details else "无详细分类数据 (Oracle)"
+        client = get_proxied_http_client()
+        logger.info(f"向 osu!oracle 查询 bid: {', '.join(payload['beatmap_ids'])}")
+        # 增加超时时间以应对模型预测耗时
+        response = await client.post(plugin_config.osu_oracle_api_url, json=payload, timeout=30.0)
+        response.raise_for_status()
+        data = response.json()
+
+        # 处理 API 可能的错误返回格式
+        if "error" in data:
+            logger.error(f"osu!oracle API 返回错误: {data['error']}")
+            return fail_all("查询失败 (Oracle API错误)")
+        if "detail" in data:
+            error_detail = data['detail'][0]['msg'] if isinstance(data['detail'], list) else data['detail']
+            logger.error(f"osu!oracle API 请求体错误: {error_detail}")
+            return fail_all("查询失败 (Oracle API请求错误)")
+
+        results: Dict[int, Tuple[Optional[Dict[str, float]], str]] = {}
+        for bid in beatmap_ids:
+            predictions = data.get(str(bid))
+            if isinstance(predictions, dict):
+                results[bid] = (predictions, "")
             else:
-                logger.warning(f"osu!oracle 未返回 bid {beatmap_id} 的有效预测结果: {data}")
-                return "查询无结果 (Oracle)" if not return_raw_probs else {}
+                logger.warning(f"osu!oracle 未返回 bid {bid} 的有效预测结果: {predictions}")
+                results[bid] = ({}, "查询无结果 (Oracle)")
+        return results
 
     except httpx.HTTPStatusError as e:
         logger.error(f"请求 osu!oracle 服务失败: HTTP {e.response.status_code} - {e.response.text}")
-        return f"查询失败 (HTTP {e.response.status_code})" if not return_raw_probs else None
+        return fail_all(f"查询失败 (HTTP {e.response.status_code})")
     except httpx.RequestError as e:
         logger.error(f"请求 osu!oracle 服务时发生网络错误: {e}")
-        return "查询失败 (网络错误)" if not return_raw_probs else None
+        return fail_all("查询失败 (网络错误)")
     except Exception as e:
         logger.error(f"调用 osu!oracle 时发生未知错误: {e}")
-        return "查询失败 (未知错误)" if not return_raw_probs else None
\ No newline at end of file
+        return fail_all("查询失败 (未知错误)")
+
+
+async def _dispatch_oracle_batch(beatmap_ids: List[int]) -> None:
+    """发送一批 Oracle 查询，并把结果分发给等待各个 bid 的 Future。"""
+    results: Dict[int, Tuple[Optional[Dict[str, float]], str]] = {}
+    try:
+        results = await _request_oracle_predictions(beatmap_ids)
+        # 整批失败可能只由其中一个 bid 引起，逐个重试，避免牵连同批的其他请求
+        failed_ids = [bid for bid in beatmap_ids if results.get(bid, (None, ""))[0] is None]
+        if len(beatmap_ids) > 1 and failed_ids:
+            retried = await asyncio.gather(*(_request_oracle_predictions([bid]) for bid in failed_ids))
+            for single_result in retried:
+                results.update(single_result)
+    finally:
+        for bid in beatmap_ids:
+            future = _oracle_pending.pop(bid, None)
+            if future is not None and not future.done():
+                future.set_result(results.get(bid, (None, "查询失败 (未知错误)")))
+
+
+async def _oracle_batch_worker() -> None:
+    """等待第一个查询到来后，在短时间窗口内收集更多 bid，合并为一次请求发送。"""
+    loop = asyncio.get_running_loop()
+    while True:
+        beatmap_ids = [await _oracle_queue.get()]
+        deadline = loop.time() + ORACLE_BATCH_WINDOW_SECONDS
+        while len(beatmap_ids) < ORACLE_BATCH_MAX_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                beatmap_ids.append(await asyncio.wait_for(_oracle_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # 请求可能耗时较长，放到独立任务中发送，不阻塞下一批的收集
+        task = asyncio.create_task(_dispatch_oracle_batch(beatmap_ids))
+        _oracle_batch_tasks.add(task)
+        task.add_done_callback(_oracle_batch_tasks.discard)
+
+
+async def _queue_oracle_request(beatmap_id: int) -> Tuple[Optional[Dict[str, float]], str]:
+    """将 bid 加入合并查询队列；同一 bid 已在查询中时直接复用其结果。"""
+    global _oracle_queue, _oracle_worker_task
+    future = _oracle_pending.get(beatmap_id)
+    if future is None:
+        future = asyncio.get_running_loop().create_future()
+        _oracle_pending[beatmap_id] = future
+        if _oracle_queue is None:
+            _oracle_queue = asyncio.Queue()
+        if _oracle_worker_task is None or _oracle_worker_task.done():
+            _oracle_worker_task = asyncio.create_task(_oracle_batch_worker())
+        _oracle_queue.put_nowait(beatmap_id)
+    # 调用方被取消时不应影响共享同一 Future 的其他请求
+    return await asyncio.shield(future)
+
+
+@driver.on_shutdown
+async def _stop_oracle_batch_worker():
+    """关闭时取消合并查询任务及仍在发送中的批次"""
+    if _oracle_worker_task:
+        _oracle_worker_task.cancel()
+    for task in list(_oracle_batch_tasks):
+        task.cancel()
+
+
+async def get_oracle_classification(beatmap_id: int, return_raw_probs: bool = False) -> Optional[Union[str, Dict[str, float]]]:
+    """
+    根据 beatmap_id 查询 osu!oracle 的谱面分类。
+    分类结果对同一谱面是确定的，因此缓存在 Redis 中；缓存过期后若 Oracle 不可用，则继续使用旧结果。
+    
+    :param beatmap_id: 谱面ID。
+    :param return_raw_probs: 若为 True，返回原始概率字典；否则返回格式化后的字符串。
+    :return: 格式化字符串、概率字典或在失败时返回特定错误字符串/None。
+    """
+    if not plugin_config.osu_oracle_api_url:
+        logger.warning("osu!oracle API URL 未在配置中设置。")
+        return "查询失败 (Oracle API未配置)" if not return_raw_probs else None
+
+    cache_key = f"oracle:{beatmap_id}"
+    cached = await _oracle_cache_get(cache_key)
+    if cached and time.time() - cached[0] < ORACLE_CACHE_FRESH_SECONDS:
+        logger.debug(f"使用已缓存的 osu!oracle 分类 (bid: {beatmap_id})")
+        predictions, hint = cached[1], ""
+    else:
+        predictions, hint = await _queue_oracle_request(beatmap_id)
+        if predictions:
+            await _oracle_cache_set(cache_key, predictions)
+        elif predictions is None and cached:
+            logger.warning(f"osu!oracle 请求失败，使用过期的缓存分类 (bid: {beatmap_id})")
+            predictions, hint = cached[1], ""
+
+    if predictions is None:
+        return hint if not return_raw_probs else None
+    if return_raw_probs:
+        return predictions
+    if not predictions:
+        return hint or "未知类型 (Oracle无详细分类)"
+
+    sorted_predictions = sorted(predictions.items(), key=lambda item: item[1], reverse=True)
+    details = [f"{name.capitalize()}: {prob:.2%}" for name, prob in sorted_predictions]
+    return ", ".join(details) if details else "无详细分类数据 (Oracle)"